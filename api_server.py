@@ -1,24 +1,84 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
 import sys
 import os
+import json
+import queue
+import threading
 import multiprocessing
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from src.main import create_user_session, process_message
+from src.main import create_user_session, process_turn, routing_tables
+from src.session_store import SessionStore
+from src.models.admission import ollama_admission, OllamaOverloadedError
+from src.models.ollama_client import ollama_client, prefix_cache_stats
+from src.models.lifecycle import model_lifecycle
+from src.metrics import metrics
+from src.models.sinks import NullSink, SSESink
+from src.answer_cache import answer_cache
+from src.embedding_cache import embedding_cache
+from src.context_augmentation.context import embedding_batcher
+from src.context_augmentation.pre_routing import pre_router
 
 multiprocessing.set_start_method('spawn', force=True)
 
 app = Flask(__name__)
 CORS(app)
 
-sessions = {}
+SESSION_MAX_ENTRIES = int(os.environ.get("SESSION_MAX_ENTRIES", 100))
+SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", 30 * 60))  # seconds
+SESSION_MAX_MEMORY_MB = os.environ.get("SESSION_MAX_MEMORY_MB")  # unset = no memory cap
+OVERLAP_CONFIDENCE = os.environ.get("OVERLAP_CONFIDENCE", "0") == "1"
+LOGPROB_CONFIDENCE = os.environ.get("LOGPROB_CONFIDENCE", "0") == "1"
+EARLY_ABORT = os.environ.get("EARLY_ABORT", "1") == "1"
 
 class Args:
     def __init__(self):
         self.verbose = True
         self.generate_data = False
+        self.overlap_confidence = OVERLAP_CONFIDENCE
+        self.logprob_confidence = LOGPROB_CONFIDENCE
+        self.early_abort = EARLY_ABORT
+
+def overloaded_response(retry_after):
+    response = jsonify({
+        'error': 'Server is busy, please retry shortly.',
+        'retry_after': retry_after
+    })
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def build_session(user_id):
+    args = Args()
+    retrievers, router = create_user_session(args, user_id)
+    return {
+        'retrievers': retrievers,
+        'router': router,
+        'conversation': [],
+        'filtered_convo': [],
+        'args': args
+    }
+
+def close_session(session):
+    if hasattr(session['router'], 'close'):
+        session['router'].close()
+    for r in session['retrievers'].values():
+        if hasattr(r, 'close'):
+            r.close()
+
+sessions = SessionStore(
+    factory=build_session,
+    max_entries=SESSION_MAX_ENTRIES,
+    idle_ttl=SESSION_IDLE_TTL,
+    max_memory_bytes=int(float(SESSION_MAX_MEMORY_MB) * 1024 * 1024) if SESSION_MAX_MEMORY_MB else None,
+    on_evict=close_session
+)
+
+# Load the models in the background (not in the debug reloader's watcher process, which serves nothing)
+if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+    model_lifecycle.start()
 
 @app.route('/api/session/start', methods=['POST'])
 def start_session():
@@ -43,10 +103,9 @@ def start_session():
             return jsonify({'error': 'User ID must be a number'}), 400
         
         print(f"Creating session for user {user_id}...")
-        args = Args()
         
         try:
-            retrievers, router = create_user_session(args, user_id)
+            sessions.create(user_id)
             print(f"Retrievers and router created successfully")
         except Exception as e:
             print(f"Failed to create session: {str(e)}")
@@ -54,16 +113,8 @@ def start_session():
             traceback.print_exc()
             raise
         
-        sessions[user_id] = {
-            'retrievers': retrievers,
-            'router': router,
-            'conversation': [],
-            'filtered_convo': [],
-            'args': args
-        }
-        
         print(f"Session stored for user {user_id}")
-        print(f"Active sessions: {list(sessions.keys())}")
+        print(f"Active sessions: {sessions.keys()}")
         print(f"{'='*60}\n")
         
         return jsonify({
@@ -94,7 +145,7 @@ def chat():
         print(f"{'='*60}")
         print(f"User ID: {user_id}")
         print(f"Message: {message}")
-        print(f"Active sessions: {list(sessions.keys())}")
+        print(f"Active sessions: {sessions.keys()}")
         
         if not user_id or not message:
             print("Error: Missing user ID or message")
@@ -106,36 +157,45 @@ def chat():
             print(f"Error: Invalid user ID '{user_id}'")
             return jsonify({'error': 'User ID must be a number'}), 400
         
+        if ollama_admission.is_saturated():
+            print("Rejecting request: Ollama queue is full")
+            return overloaded_response(ollama_admission.retry_after())
+        
         if user_id not in sessions:
-            print(f"Session not found for user {user_id}")
-            print(f"   Available sessions: {list(sessions.keys())}")
-            print(f"{'='*60}\n")
-            return jsonify({'error': 'Session not found. Please start a new session.'}), 404
+            # Sessions are evicted after SESSION_IDLE_TTL or when the store is full,
+            # so rebuild it transparently instead of failing the request.
+            print(f"Session not found for user {user_id}, re-creating it")
         
-        session = sessions[user_id]
+        session = sessions.get(user_id)
         print("Session found")
         print("Processing message...")
         
-        reply = process_message(
+        result = process_turn(
             user_id=user_id,
             user_input=message,
             args=session['args'],
             conversation=session['conversation'],
             filtered_convo=session['filtered_convo'],
             retrievers=session['retrievers'],
-            router=session['router']
+            router=session['router'],
+            sink=NullSink()  # the reply is returned in one piece, nobody reads the token stream
         )
+        reply = result['reply']
         
         print(f"Reply generated: {reply[:100]}...")
         print(f"{'='*60}\n")
         
         return jsonify({
             'reply': reply,
-            'confidence': True,
-            'used_llm': False,
+            'confidence': bool(result['confidence']),
+            'used_llm': result['used_llm'],
+            'cached': result['cached'],
             'user_id': user_id
         })
         
+    except OllamaOverloadedError as e:
+        print(f"Rejecting request: {str(e)}")
+        return overloaded_response(e.retry_after)
     except Exception as e:
         print(f"\n{'='*60}")
         print(f"ERROR IN CHAT")
@@ -146,6 +206,91 @@ def chat():
         print(f"{'='*60}\n")
         return jsonify({'error': str(e)}), 500
 
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    Same as /api/chat, but answers with a text/event-stream:
+      - `token` events carry SLM tokens as Ollama produces them
+      - a final `done` event carries the confidence verdict and, if the SLM was not
+        confident, the replacement LLM answer in `reply`
+      - an `error` event is sent instead of `done` if the pipeline fails
+    """
+    data = request.json
+    user_id = data.get('user_id')
+    message = data.get('message')
+
+    if not user_id or not message:
+        return jsonify({'error': 'User ID and message are required'}), 400
+
+    try:
+        user_id = int(user_id)
+    except ValueError:
+        return jsonify({'error': 'User ID must be a number'}), 400
+
+    if ollama_admission.is_saturated():
+        return overloaded_response(ollama_admission.retry_after())
+
+    try:
+        session = sessions.get(user_id)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    events = queue.Queue()
+
+    def run_pipeline():
+        try:
+            result = process_turn(
+                user_id=user_id,
+                user_input=message,
+                args=session['args'],
+                conversation=session['conversation'],
+                filtered_convo=session['filtered_convo'],
+                retrievers=session['retrievers'],
+                router=session['router'],
+                sink=SSESink(events)
+            )
+            events.put(('done', {
+                'reply': result['reply'],
+                'slm_reply': result['slm_reply'],
+                'confidence': bool(result['confidence']),
+                'used_llm': result['used_llm'],
+                'cached': result['cached'],
+                'user_id': user_id
+            }))
+        except OllamaOverloadedError as e:
+            events.put(('error', {'error': str(e), 'retry_after': e.retry_after}))
+        except Exception as e:
+            print(f"Error in chat stream: {str(e)}")
+            import traceback
+            traceback.print_exc()
+            events.put(('error', {'error': str(e)}))
+        finally:
+            events.put(None)
+
+    threading.Thread(target=run_pipeline, daemon=True).start()
+
+    def generate():
+        while True:
+            items = [events.get()]
+            # Send everything that queued up while the last write was in flight in one chunk
+            while items[-1] is not None and not events.empty():
+                items.append(events.get_nowait())
+
+            payload = "".join(_sse_event(*item) for item in items if item is not None)
+            if payload:
+                yield payload
+            if items[-1] is None:
+                break
+
+    return Response(
+        generate(),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/api/session/end', methods=['POST'])
 def end_session():
     try:
@@ -160,17 +305,7 @@ def end_session():
         except ValueError:
             return jsonify({'error': 'User ID must be a number'}), 400
         
-        if user_id in sessions:
-            session = sessions[user_id]
-            try:
-                if hasattr(session['router'], 'close'):
-                    session['router'].close()
-                for r in session['retrievers']:
-                    if hasattr(r, 'close'):
-                        r.close()
-            except Exception as e:
-                print(f"Error closing session resources: {e}")
-            del sessions[user_id]
+        if sessions.remove(user_id):
             print(f"Session ended for user {user_id}")
         
         return jsonify({
@@ -184,18 +319,44 @@ def end_session():
 
 @app.route('/health', methods=['GET'])
 def health():
+    session_stats = sessions.stats()
     return jsonify({
         'status': 'healthy', 
-        'sessions': len(sessions),
-        'active_users': list(sessions.keys())
+        'sessions': session_stats['count'],
+        'active_users': sessions.keys(),
+        'session_store': session_stats,
+        'ollama_admission': ollama_admission.stats(),
+        'ready': model_lifecycle.ready()
     })
 
+@app.route('/ready', methods=['GET'])
+def ready():
+    """200 once the models and embedders are loaded, 503 until then (for load balancer readiness probes)."""
+    status = model_lifecycle.status()
+    return jsonify(status), 200 if status['ready'] else 503
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Per-stage latency histograms (seconds), route/confidence counters and the LLM fallback rate."""
+    snapshot = metrics.snapshot()
+    snapshot['ollama_admission'] = ollama_admission.stats()
+    snapshot['ollama_client'] = ollama_client.stats()
+    snapshot['prefix_cache'] = prefix_cache_stats.stats()
+    snapshot['answer_cache'] = answer_cache.stats()
+    snapshot['embedding_cache'] = embedding_cache.stats()
+    snapshot['embedding_batcher'] = embedding_batcher.stats()
+    snapshot['routing_tables'] = routing_tables.get().stats() if routing_tables.loaded else None
+    snapshot['pre_router'] = pre_router.get().stats() if pre_router.loaded else None
+    return jsonify(snapshot)
+
 if __name__ == '__main__':
     print("\n" + "="*60)
     print("Customer Support API Server Starting...")
     print("="*60)
     print("API will be available at: http://localhost:5001")
     print("Health check: http://localhost:5001/health")
+    print("Readiness: http://localhost:5001/ready")
+    print("Metrics: http://localhost:5001/metrics")
     print("="*60 + "\n")
     
     app.run(debug=True, host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -75,9 +75,12 @@ const CustomerSupportChat = () => {
     setInputMessage('');
     setIsLoading(true);
 
+    // Set once the assistant message being streamed into has been added
+    let streaming = false;
+
     try {
-      // Replace this with your actual API call to the backend
-      const response = await fetch('/api/chat', {
+      // Tokens are streamed back as server-sent events, see /api/chat/stream in api_server.py
+      const response = await fetch('/api/chat/stream', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
         body: JSON.stringify({
@@ -86,23 +89,62 @@ const CustomerSupportChat = () => {
         })
       });
 
-      const data = await response.json();
+      if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
+      }
 
-      const assistantMessage = {
+      setMessages(prev => [...prev, {
         role: 'assistant',
-        content: data.reply || 'I apologize, but I encountered an issue processing your request.',
-        confidence: data.confidence,
-        usedLLM: data.used_llm,
+        content: '',
         timestamp: new Date()
+      }]);
+      streaming = true;
+      setIsLoading(false);
+
+      const updateLastMessage = (update) => {
+        setMessages(prev => [...prev.slice(0, -1), { ...prev[prev.length - 1], ...update(prev[prev.length - 1]) }]);
       };
 
-      setMessages(prev => [...prev, assistantMessage]);
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+
+      while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+
+        for (const raw of events) {
+          const event = raw.match(/^event: (.*)$/m)?.[1];
+          const data = JSON.parse(raw.match(/^data: (.*)$/m)?.[1] || '{}');
+
+          if (event === 'start') {
+            // A new answer (e.g. the LLM fallback) replaces what was streamed so far
+            updateLastMessage(() => ({ content: '' }));
+          } else if (event === 'token') {
+            updateLastMessage(msg => ({ content: msg.content + data.token }));
+          } else if (event === 'done') {
+            updateLastMessage(() => ({
+              content: data.reply || 'I apologize, but I encountered an issue processing your request.',
+              confidence: data.confidence,
+              usedLLM: data.used_llm
+            }));
+          } else if (event === 'error') {
+            throw new Error(data.error);
+          }
+        }
+      }
     } catch (err) {
-      setMessages(prev => [...prev, {
+      const errorMessage = {
         role: 'assistant',
         content: 'Sorry, I encountered an error. Please try again.',
         timestamp: new Date()
-      }]);
+      };
+      // The error replaces the (possibly empty) message that was being streamed
+      setMessages(prev => streaming ? [...prev.slice(0, -1), errorMessage] : [...prev, errorMessage]);
     } finally {
       setIsLoading(false);
     }
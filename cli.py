@@ -1,5 +1,4 @@
 import argparse
-from src.main import main_loop
 
 def main():
     parser = argparse.ArgumentParser()
@@ -16,8 +15,45 @@ def main():
         action="store_true"
     )
 
+    parser.add_argument(
+        "--overlap_confidence",
+        "-oc",
+        action="store_true",
+        help="Generate the confidence samples while the answer is streaming (needs OLLAMA_NUM_PARALLEL > 1)"
+    )
+
+    parser.add_argument(
+        "--logprob_confidence",
+        "-lc",
+        action="store_true",
+        help="Score confidence from the answer's token logprobs instead of ROUGE resampling"
+    )
+
+    parser.add_argument(
+        "--no_answer_cache",
+        dest="answer_cache",
+        action="store_false",
+        help="Always run the full pipeline instead of reusing answers to similar earlier questions"
+    )
+
+    parser.add_argument(
+        "--no_early_abort",
+        dest="early_abort",
+        action="store_false",
+        help="Always let the SLM finish its answer, even when it already says it is unsure"
+    )
+
+    parser.add_argument(
+        "--no_pre_router",
+        dest="pre_router",
+        action="store_false",
+        help="Route every query with embeddings, even when an invoice number or product code makes its route obvious"
+    )
+
     args = parser.parse_args()
 
+    # Imported after parsing so --help doesn't load the whole pipeline
+    from src.main import main_loop
     main_loop(args)
 
 if __name__ == "__main__":
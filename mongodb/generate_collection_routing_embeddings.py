@@ -15,11 +15,16 @@ that we route to for context-augmentation.
 """
 
 import os
+import json
+import hashlib
+import datetime
 from pymongo import MongoClient
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from dotenv import load_dotenv
 
+from routing_examples import COLLECTION_ROUTING_EXAMPLES as routing_data  # example queries per route
+
 load_dotenv()
 
 DB_NAME = "slm-capstone-proj"
@@ -33,78 +38,6 @@ collection = db[COLLECTION_NAME]
 # Initialize embedding model
 model = SentenceTransformer('all-MiniLM-L6-v2')
 
-# Define routing examples
-routing_data = {
-    "faq": [
-       "How can I create an account?",
-       "What payment methods do you accept?",
-       "How can I track my order?",
-       "What is your return policy?",
-       "Can I cancel my order?",
-       "How long does shipping take?",
-       "Do you offer international shipping?",
-       "What should I do if my package is lost or damaged?",
-       "Can I change my shipping address after placing an order?",
-       "How can I contact customer support?",
-       "Can I order by phone?",
-       "Do you have a loyalty program?",
-       "Can I change or cancel an item in my order?",
-       "How can I leave a product review?",
-       "What should I do if I receive the wrong item?",
-       "Can I order a product that is out of stock?",
-       "Can I return a product if I changed my mind?",
-       "Can I return a product without a receipt?",
-       "Can I order a product for delivery to a different country?",
-       "Can I return a product if it was damaged due to mishandling during shipping?"
-    ],
-    "purchases": [
-        "What did I order last month?",
-        "Show me my purchase history",
-        "How many CREAM CUPID HEARTS COAT HANGER did I buy?",
-        "What was my last order?",
-        "When did I buy the WHITE METAL LANTERN?",
-        "What orders did I place in December 2010?",
-        "What's my total spending this year?",
-        "Did I order from you before?",
-        "How much did I spend on my last order?",
-        "Can I see my order from last week?",
-        "What did I purchase on December 1st?",
-        "Have I ever bought any heart-themed products?",
-        "What quantity of items did I buy in my last order?",
-        "When was my first purchase with you?",
-        "When did I last order a mug?",
-        "What is the tracking number of my lastest order?",
-        "What is the order number of my red mugs?",
-        "What country was my glasses shipped to?",
-        "When was my latest order?",
-        "Has my order 536367 arrived?",
-        "Has my latest order arrived yet?",
-        "Has my latest order been delivered yet?",
-        "How many wooden frames have I bought before?",
-        "How much have I spent on christmas decorations?",
-        "How many measuring tapes have I bought before?",
-        "What types of measuring tapes have I bought before?",
-        "How much have I spent on measuring tapes in total?",
-    ],
-    "products": [
-        "Do you have INFLATABLE POLITICAL GLOBE in stock?",
-        "How much does the GROOVY CACTUS INFLATABLE cost?",
-        "What's the price of DOGGY RUBBER?",
-        "Is the HEARTS WRAPPING TAPE available?",
-        "How many SPOTS ON RED BOOKCOVER TAPE do you have in stock?",
-        "Show me products with 'HEART' in the name",
-        "What inflatable products do you sell?",
-        "Do you have any wrapping tape in stock?",
-        "What's the cheapest product you have?",
-        "Are there any cactus-themed items available?",
-        "How much stock do you have of the DOGGY RUBBER?",
-        "What products are currently out of stock?",
-        "Do you sell any political or globe items?"
-        "What is the stock code of the antique frames?",
-        "What's the difference between a gold and black tape measure?"
-    ]
-}
-
 # Clear existing collection if it exists
 collection.delete_many({})
 
@@ -121,9 +54,18 @@ for route, examples in routing_data.items():
         "route": route,
         "examples": examples,
         "embedding": avg_embedding,
+        "example_embeddings": embeddings.tolist(),  # for the k-NN router (ROUTER_MODE=knn)
     }
     collection.insert_one(document)
 
+# Bump the version so running servers reload their routing tables (see RoutingTables in src/context_augmentation/routing.py)
+checksum = hashlib.sha256(json.dumps(routing_data, sort_keys=True).encode()).hexdigest()
+db["routing_versions"].replace_one(
+    {"_id": COLLECTION_NAME},
+    {"_id": COLLECTION_NAME, "checksum": checksum, "updated_at": datetime.datetime.utcnow()},
+    upsert=True
+)
+
 print(f"Created {collection.count_documents({})} aggregated route embeddings")
 
 # Create vector search indexes (requires MongoDB Atlas or MongoDB 6.0+)
@@ -0,0 +1,150 @@
+"""
+Example queries for the routes of the semantic router (src/context_augmentation/routing.py).
+
+The generate_*_routing_embeddings.py scripts embed and average these to build the route
+embeddings stored in MongoDB. TEST_QUERIES are held-out queries with the route they should
+get, used by test_routing.py and the routing/embedding benchmarks.
+"""
+
+# Routes of the "collection_routing" collection: which collection a query needs
+COLLECTION_ROUTING_EXAMPLES = {
+    "faq": [
+       "How can I create an account?",
+       "What payment methods do you accept?",
+       "How can I track my order?",
+       "What is your return policy?",
+       "Can I cancel my order?",
+       "How long does shipping take?",
+       "Do you offer international shipping?",
+       "What should I do if my package is lost or damaged?",
+       "Can I change my shipping address after placing an order?",
+       "How can I contact customer support?",
+       "Can I order by phone?",
+       "Do you have a loyalty program?",
+       "Can I change or cancel an item in my order?",
+       "How can I leave a product review?",
+       "What should I do if I receive the wrong item?",
+       "Can I order a product that is out of stock?",
+       "Can I return a product if I changed my mind?",
+       "Can I return a product without a receipt?",
+       "Can I order a product for delivery to a different country?",
+       "Can I return a product if it was damaged due to mishandling during shipping?"
+    ],
+    "purchases": [
+        "What did I order last month?",
+        "Show me my purchase history",
+        "How many CREAM CUPID HEARTS COAT HANGER did I buy?",
+        "What was my last order?",
+        "When did I buy the WHITE METAL LANTERN?",
+        "What orders did I place in December 2010?",
+        "What's my total spending this year?",
+        "Did I order from you before?",
+        "How much did I spend on my last order?",
+        "Can I see my order from last week?",
+        "What did I purchase on December 1st?",
+        "Have I ever bought any heart-themed products?",
+        "What quantity of items did I buy in my last order?",
+        "When was my first purchase with you?",
+        "When did I last order a mug?",
+        "What is the tracking number of my lastest order?",
+        "What is the order number of my red mugs?",
+        "What country was my glasses shipped to?",
+        "When was my latest order?",
+        "Has my order 536367 arrived?",
+        "Has my latest order arrived yet?",
+        "Has my latest order been delivered yet?",
+        "How many wooden frames have I bought before?",
+        "How much have I spent on christmas decorations?",
+        "How many measuring tapes have I bought before?",
+        "What types of measuring tapes have I bought before?",
+        "How much have I spent on measuring tapes in total?",
+    ],
+    "products": [
+        "Do you have INFLATABLE POLITICAL GLOBE in stock?",
+        "How much does the GROOVY CACTUS INFLATABLE cost?",
+        "What's the price of DOGGY RUBBER?",
+        "Is the HEARTS WRAPPING TAPE available?",
+        "How many SPOTS ON RED BOOKCOVER TAPE do you have in stock?",
+        "Show me products with 'HEART' in the name",
+        "What inflatable products do you sell?",
+        "Do you have any wrapping tape in stock?",
+        "What's the cheapest product you have?",
+        "Are there any cactus-themed items available?",
+        "How much stock do you have of the DOGGY RUBBER?",
+        "What products are currently out of stock?",
+        "Do you sell any political or globe items?"
+        "What is the stock code of the antique frames?",
+        "What's the difference between a gold and black tape measure?"
+    ]
+}
+
+# Routes of the "purchases_routing" collection: how to search the user's purchases
+PURCHASES_ROUTING_EXAMPLES = {
+    "order_based": [
+        "Tell me about my latest order",
+        "What was my most recent purchase?",
+        "When did I last order my latest purchase?",
+        "What is the tracking number for my most recent purchase?",
+        "What items do I have in my latest order?",
+        "How much did I spend on my latest order?",
+        "How many items did I buy in my latest order?",
+        "Where was my most recent order shipped to?",
+        "Show me my last order",
+        "What did I just buy?",
+        "Details about my newest order",
+        "My most recent transaction",
+        "How many vases did I buy in my latest order?",
+        "Tell me about my order C56332",
+        "How many vases did I buy in order with tracking number 32345?",
+        "How much did order 832301 cost?",
+        "How many doorbells did I buy in C29834?",
+        "What did I order on Dec. 10th, 2011?",
+        "how many boxes did I buy on Nov. 23rd, 2010?",
+        "Has my most recent order been delivered?",
+        "What's the delivery status on my most recent order?",
+        "Did I order any pens in my most recent order?",
+        "Does my latest order contain any vases?",
+        "How many antiques did i buy in my most recent order?",
+        "How many gummies did I buy in order 234859?"
+    ],
+    "item_based": [
+        "When was the last time I ordered socks?",
+        "How much have I spent on halloween decorations in total?",
+        "How many candles have I bought?",
+        "have I bought a pan before?",
+        "What was the last time I ordered a pencil sharpener?",
+        "Show me all my candle purchases",
+        "Find purchases containing 'heart'",
+        "How many times have I ordered the DOGGY RUBBER?",
+        "History of all my lantern purchases",
+        "When was my latest order of pet food?",
+        "What types of antiques have I bought before?",
+        "How many frames have I ordered before?",
+        "Have I bought any photo cubes before?",
+        "Have I ordered a disco ball before?"
+    ]
+}
+
+# Held-out queries, by the route they should be sent to
+TEST_QUERIES = {
+    "faq": [
+        "What is your return policy?",
+        "How long does shipping take?",
+        "What methods of payment do you accept?",
+    ],
+    "purchases": [
+        "When did I last order some mittens?",
+        "Have I bought christmas decorations before?",
+        "How much have I spent on jugs?",
+        "Tell me about my latest order.",
+        "When was my latest order?",
+        "How many labubus have I bought?",
+        "What is the invoice number on my labubu shipment?",
+    ],
+    "products": [
+        "Do you have any socks in stock?",
+        "How much does the textbook cost?",
+        "Are there any christmas products available?",
+        "What is the stock code of the water bottles?",
+    ],
+}
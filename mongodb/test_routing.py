@@ -9,6 +9,8 @@ from sklearn.metrics.pairwise import cosine_similarity
 import os
 from dotenv import load_dotenv
 
+from routing_examples import TEST_QUERIES
+
 # Load environment variables
 load_dotenv()
 DB_NAME = "slm-capstone-proj"
@@ -118,27 +120,7 @@ def evaluate_routing(test_queries):
         print("\n" + "="*80 + "\n")
 
 # Test queries covering all three routes and edge cases
-test_queries = [
-    # FAQ queries
-    "What is your return policy?",
-    "How long does shipping take?",
-    "What methods of payment do you accept?",
-    
-    # Purchase history queries
-    "When did I last order some mittens?",
-    "Have I bought christmas decorations before?",
-    "How much have I spent on jugs?",
-    "Tell me about my latest order.",
-    "When was my latest order?",
-    "How many labubus have I bought?",
-    "What is the invoice number on my labubu shipment?",
-    
-    # Product stock queries
-    "Do you have any socks in stock?",
-    "How much does the textbook cost?",
-    "Are there any christmas products available?",
-    "What is the stock code of the water bottles?"
-]
+test_queries = [query for queries in TEST_QUERIES.values() for query in queries]
 
 # Run evaluation
 if __name__ == "__main__":
@@ -0,0 +1,150 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from src.metrics import metrics
+
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 1000))
+ANSWER_CACHE_TTL = float(os.environ.get("ANSWER_CACHE_TTL", 60 * 60))  # seconds
+ANSWER_CACHE_SIMILARITY = float(os.environ.get("ANSWER_CACHE_SIMILARITY", 0.95))  # min cosine similarity
+
+# Answers for these routes only depend on shared data, so they are cached for everyone.
+# Routes listed with "user" are cached per user. Other routes are not cached.
+CACHE_SCOPES = {
+    "faq": "global",
+    "products": "global",
+    "purchases": "user",
+}
+
+
+def context_hash(context):
+    return hashlib.sha1((context or "").encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    """
+    Semantic cache of final answers.
+
+    An entry matches a new query when it is in the same scope (route, plus the user for
+    per-user routes), its query embedding has a cosine similarity of at least
+    `similarity_threshold` with the new one, and the context retrieved for the new query
+    hashes to the same value (so answers are never served from outdated data).
+    Entries expire after `ttl` seconds and the least recently used are evicted beyond
+    `max_entries`.
+    """
+
+    def __init__(self, max_entries=1000, ttl=60 * 60, similarity_threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+
+        self._entries = OrderedDict()  # entry id -> entry, least recently used first
+        self._scopes = {}  # scope -> set of entry ids
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+
+    def _scope(self, route, user_id):
+        kind = CACHE_SCOPES.get(route)
+        if kind == "global":
+            return (route,)
+        if kind == "user":
+            return (route, user_id)
+        return None
+
+    def _remove_locked(self, entry_id):
+        entry = self._entries.pop(entry_id)
+        ids = self._scopes[entry["scope"]]
+        ids.discard(entry_id)
+        if not ids:
+            del self._scopes[entry["scope"]]
+
+    def _expire_locked(self):
+        now = time.time()
+        expired = [i for i, e in self._entries.items() if now - e["created_at"] > self.ttl]
+        for entry_id in expired:
+            self._remove_locked(entry_id)
+
+    def lookup(self, route, user_id, query_embedding, context):
+        """Return the cached entry for this query, or None."""
+        scope = self._scope(route, user_id)
+        if scope is None:
+            return None
+
+        with self._lock:
+            self._expire_locked()
+
+            ids = list(self._scopes.get(scope, ()))
+            if not ids:
+                self.misses += 1
+                metrics.increment("answer_cache", "miss")
+                return None
+
+            # Embeddings are normalized, so the dot product is the cosine similarity
+            embeddings = np.stack([self._entries[i]["embedding"] for i in ids])
+            similarities = embeddings @ query_embedding
+            best = int(np.argmax(similarities))
+            entry_id = ids[best]
+            entry = self._entries[entry_id]
+
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                metrics.increment("answer_cache", "miss")
+                return None
+
+            if entry["context_hash"] != context_hash(context):
+                # Same question, but the underlying data changed
+                self._remove_locked(entry_id)
+                self.stale += 1
+                metrics.increment("answer_cache", "stale")
+                return None
+
+            self._entries.move_to_end(entry_id)
+            self.hits += 1
+            metrics.increment("answer_cache", "hit")
+            return entry
+
+    def store(self, route, user_id, query_embedding, context, reply, **extra):
+        """Cache `reply` (and any `extra` fields, returned with it on a hit)."""
+        scope = self._scope(route, user_id)
+        if scope is None or not reply:
+            return
+
+        entry = {
+            "scope": scope,
+            "embedding": np.asarray(query_embedding, dtype=np.float32),
+            "context_hash": context_hash(context),
+            "reply": reply,
+            "created_at": time.time(),
+            **extra,
+        }
+
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = entry
+            self._scopes.setdefault(scope, set()).add(entry_id)
+
+            while len(self._entries) > self.max_entries:
+                self._remove_locked(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+                "hit_rate": self.hits / lookups if lookups else None,
+            }
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL, ANSWER_CACHE_SIMILARITY)
@@ -1,10 +1,16 @@
+import os
 import re
-import requests
-import time
-from rouge_score import rouge_scorer
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 
-OLLAMA_API = "http://localhost:11434/api/generate" # ollama API endpoint
+from src.models.admission import ollama_admission, OllamaOverloadedError
+from src.models.ollama_client import ollama_client, prefix_cache_stats, OLLAMA_KEEP_ALIVE
+from src.metrics import metrics
+
+OLLAMA_API = "/api/chat" # ollama API endpoint, see src/models/ollama_client.py for the host
+SAMPLE_PARALLELISM = int(os.environ.get("OLLAMA_NUM_PARALLEL", 2))  # confidence samples requested at once
 
 def get_verbalized_confidence(answer):
     answer = answer.lower()
@@ -23,41 +29,147 @@ def get_verbalized_confidence(answer):
 
     return confident
 
-def generate_multiple_responses(model, prompt, num_samples=2):
-    responses = []
-    
-    payload_base = {
+
+class VerbalizedConfidenceMonitor:
+    """
+    Incremental `get_verbalized_confidence` for an answer that is still streaming.
+
+    `feed(chunk)` returns False as soon as the text received so far fails the verbalized check,
+    so the caller can stop the generation early. Only complete words are checked (a trailing
+    "as a" could still become "as apple"); the rest is left to the final check.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self._checked = 0
+
+    def feed(self, chunk):
+        self.text += chunk
+
+        end = max(self.text.rfind(" "), self.text.rfind("\n"))
+        if end <= self._checked:
+            return True
+
+        self._checked = end
+        return get_verbalized_confidence(self.text[:end])
+
+def _sample_payload(model, messages, stream=False):
+    # Same messages as the primary call, so Ollama can reuse the cached prompt prefix.
+    return {
         "model": model,
-        "prompt": prompt,
-        "stream": False,
+        "messages": messages,
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
         "options": {
             "num_predict": 100,
-            "stop": ["\n\n", "You:"],
+            "stop": ["\n\n"],
             "temperature": 0.7,  # sampling temperature (higher = more diverse)
         }
     }
-    
-    for i in range(num_samples):
-        try:
-            response = requests.post(OLLAMA_API, json=payload_base)
-            response.raise_for_status()
-            
+
+
+def _generate_sample(payload, i, cancelled=None):
+    """
+    Request one sample. If a `cancelled` event is given, the sample is streamed and the
+    connection is dropped as soon as the event is set, which makes Ollama stop generating.
+    Returns None if the sample failed, but raises `OllamaOverloadedError` if it was not admitted.
+    """
+    try:
+        if cancelled is None:
+            with ollama_admission.slot():
+                response = ollama_client.post(OLLAMA_API, payload)
+
             data = response.json()
-            if "response" in data:
-                responses.append(data["response"].strip())
-            
-            time.sleep(0.1)  # small delay to avoid overwhelming the API
-            
-        except Exception as e:
-            print(f"Failed to generate sample {i+1}: {e}")
-            continue
-    
-    return responses
+            prefix_cache_stats.record("sample", payload["messages"], data)
+            if "message" in data:
+                return data["message"]["content"].strip()
+            return None
+
+        if cancelled.is_set():
+            return None
+
+        text = ""
+        with ollama_admission.slot(), ollama_client.post(OLLAMA_API, payload, stream=True) as r:
+            for line in r.iter_lines():
+                if cancelled.is_set():
+                    return None
+                if not line:
+                    continue
+                data = json.loads(line.decode("utf-8"))
+                text += data.get("message", {}).get("content", "")
+                if data.get("done", False):
+                    prefix_cache_stats.record("sample", payload["messages"], data)
+                    break
+        return text.strip()
+
+    except OllamaOverloadedError:
+        raise
+    except Exception as e:
+        print(f"Failed to generate sample {i+1}: {e}")
+
+    return None
+
+
+def generate_multiple_responses(model, messages, num_samples=2, parallelism=None):
+    """
+    Ask Ollama for `num_samples` extra answers to the chat `messages`.
+
+    Samples are requested concurrently, at most `parallelism` at a time (defaults to
+    SAMPLE_PARALLELISM, which should match the server's OLLAMA_NUM_PARALLEL).
+    Failed samples are skipped; raises `OllamaOverloadedError` if a sample was not admitted.
+    """
+    payload_base = _sample_payload(model, messages)
+
+    if parallelism is None:
+        parallelism = SAMPLE_PARALLELISM
+
+    workers = max(1, min(parallelism, num_samples))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        samples = list(executor.map(lambda i: _generate_sample(payload_base, i), range(num_samples)))
+
+    return [sample for sample in samples if sample is not None]
+
+
+class SampleJob:
+    """
+    Confidence samples requested in the background, so they can be generated while the
+    primary answer is still streaming. Use `result()` to wait for them or `cancel()` to
+    abandon them (e.g. when the primary answer already fails the verbalized check).
+    """
+
+    def __init__(self, model, messages, num_samples, parallelism=None):
+        if parallelism is None:
+            parallelism = SAMPLE_PARALLELISM
+
+        payload = _sample_payload(model, messages, stream=True)
+        self._cancelled = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, min(parallelism, num_samples)))
+        self._futures = [
+            self._executor.submit(_generate_sample, payload, i, self._cancelled)
+            for i in range(num_samples)
+        ]
+        self._executor.shutdown(wait=False)
+
+    def cancel(self):
+        self._cancelled.set()
+        for future in self._futures:
+            future.cancel()
+        metrics.increment("confidence_samples", "cancelled", len(self._futures))
+
+    def result(self):
+        samples = [future.result() for future in self._futures]
+        return [sample for sample in samples if sample is not None]
+
+
+def start_sampling(model, messages, num_samples, parallelism=None):
+    """Start generating `num_samples` confidence samples in the background, see `SampleJob`."""
+    return SampleJob(model, messages, num_samples, parallelism)
 
 
 def calculate_rouge_confidence(responses):
     rouge_types=['rouge1', 'rouge2', 'rougeL']
     
+    from rouge_score import rouge_scorer
     scorer = rouge_scorer.RougeScorer(rouge_types, use_stemmer=True)
     
     similarities = []
@@ -76,27 +188,289 @@ def calculate_rouge_confidence(responses):
     return confidence_score
 
 
-def evaluate_rouge_confidence(model, prompt, original_response, num_samples, 
-                              rouge_threshold=0.5, verbose=False):
-    if not get_verbalized_confidence(original_response):
-        if verbose:
-            print("Failed verbalized confidence check")
+# Confidence strategies, run from cheapest to most expensive by `evaluate_confidence`.
+# Each strategy gets the evaluation context dict and returns True (confident), False (not
+# confident) or None (undecided, ask the next strategy).
+CONFIDENCE_STRATEGIES = {}
+
+def confidence_strategy(name, cost):
+    def decorator(func):
+        CONFIDENCE_STRATEGIES[name] = {"cost": cost, "func": func}
+        return func
+    return decorator
+
+def _parse_cascade(value):
+    return [name.strip() for name in value.split(",") if name.strip()]
+
+# Comma-separated strategy names. "embedding" is opt-in: its thresholds are not calibrated yet.
+DEFAULT_CONFIDENCE_CASCADE = _parse_cascade(os.environ.get("CONFIDENCE_CASCADE", "verbalized,logprob,rouge"))
+
+# Strategies used per route (see Router.route_collection), e.g. CONFIDENCE_CASCADE_PURCHASES.
+# Routes without one use the default.
+ROUTE_CONFIDENCE_CASCADES = {
+    route: _parse_cascade(os.environ[f"CONFIDENCE_CASCADE_{route.upper()}"])
+    for route in ("faq", "products", "purchases")
+    if os.environ.get(f"CONFIDENCE_CASCADE_{route.upper()}")
+}
+
+# Maps token logprob stats to the same 0-1 scale as the ROUGE score, so `rouge_threshold` keeps
+# its meaning. Written by tests/calibrate_logprob_confidence.py; without it the logprob strategy
+# never decides (raw token probabilities are high for almost every phi3 answer).
+LOGPROB_CALIBRATION_PATH = "data/logprob_calibration.json"
+LOGPROB_MARGIN = 0.15  # in the cascade, the calibrated score must be this far from the threshold to decide
+
+# Not calibrated: short correct answers ("$2.55") can be far from every context block. Pick them
+# from the `embedding_agreement` histogram in GET /metrics before adding "embedding" to the cascade.
+EMBEDDING_CONFIDENT = float(os.environ.get("EMBEDDING_CONFIDENT", 0.8))  # answer very close to a retrieved context block
+EMBEDDING_NOT_CONFIDENT = float(os.environ.get("EMBEDDING_NOT_CONFIDENT", 0.2))  # answer unrelated to the retrieved context
+
+
+@confidence_strategy("verbalized", cost=0)
+def _verbalized_strategy(ctx):
+    if get_verbalized_confidence(ctx["response"]):
+        return None
+
+    if ctx["verbose"]:
+        print("Failed verbalized confidence check")
+    metrics.increment("confidence", "failed_verbalized")
+    return False
+
+
+def summarize_logprobs(token_logprobs):
+    """
+    Summarize the per-token logprobs returned by Ollama (`"logprobs": true`) for an answer.
+
+    Returns the mean and min token logprob and the mean entropy of the top-k distribution
+    of each token, or None if no logprobs were returned (e.g. an older Ollama).
+    """
+    if not token_logprobs:
+        return None
+
+    logprobs = np.array([t["logprob"] for t in token_logprobs], dtype=np.float64)
+
+    entropies = []
+    for t in token_logprobs:
+        top = t.get("top_logprobs") or []
+        if not top:
+            continue
+        probs = np.exp([alt["logprob"] for alt in top])
+        probs = probs / probs.sum()  # renormalize over the top-k alternatives
+        entropies.append(float(-np.sum(probs * np.log(probs + 1e-12))))
+
+    return {
+        "mean_logprob": float(np.mean(logprobs)),
+        "min_logprob": float(np.min(logprobs)),
+        "entropy": float(np.mean(entropies)) if entropies else 0.0,
+        "num_tokens": len(token_logprobs),
+    }
+
+
+_logprob_calibration = None
+
+def load_logprob_calibration(path=LOGPROB_CALIBRATION_PATH):
+    global _logprob_calibration
+    if _logprob_calibration is None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                _logprob_calibration = json.load(f)
+        except FileNotFoundError:
+            _logprob_calibration = {}
+    return _logprob_calibration
+
+
+def logprob_confidence_score(stats, calibration=None):
+    """Map logprob stats to a 0-1 score comparable with the ROUGE confidence score."""
+    if calibration is None:
+        calibration = load_logprob_calibration()
+
+    if not calibration:
+        return float(np.exp(stats["mean_logprob"]))
+
+    score = calibration["intercept"] + sum(
+        weight * stats[feature] for feature, weight in calibration["weights"].items()
+    )
+    return float(np.clip(score, 0.0, 1.0))
+
+
+@confidence_strategy("logprob", cost=1)
+def _logprob_strategy(ctx):
+    stats = ctx.get("logprobs")
+    if not stats:
+        return None
+
+    calibration = load_logprob_calibration()
+    if not calibration:
+        metrics.increment("confidence", "logprob_uncalibrated")
+        return None
+
+    score = logprob_confidence_score(stats, calibration)
+    metrics.observe("logprob_score", score)
+    threshold = ctx["rouge_threshold"]
+
+    if ctx["verbose"]:
+        print(
+            f"Logprob Confidence Score: {score:.4f} (mean {stats['mean_logprob']:.4f}, "
+            f"min {stats['min_logprob']:.4f}, entropy {stats['entropy']:.4f}, threshold: {threshold})"
+        )
+
+    # In logprob mode the score replaces the ROUGE score; in the cascade it only decides
+    # when it is clearly on one side of the threshold.
+    margin = 0.0 if ctx.get("logprob_only") else LOGPROB_MARGIN
+
+    if score >= threshold + margin:
+        metrics.increment("confidence", "confident_logprob")
+        return True
+    if score < threshold - margin:
+        metrics.increment("confidence", "failed_logprob")
+        return False
+    return None
+
+
+@confidence_strategy("embedding", cost=2)
+def _embedding_strategy(ctx):
+    context = ctx.get("context")
+    response = ctx["response"].strip()
+    if not context or not response:
+        return None
+
+    # Imported here so this module does not load the embedding model by itself.
+    from src.context_augmentation.context import embed_text
+
+    blocks = [block for block in context.split("\n\n") if block.strip()]
+    response_embedding = embed_text(response)
+    similarity = max(float(np.dot(response_embedding, embed_text(block))) for block in blocks)
+    metrics.observe("embedding_agreement", similarity)
+
+    if ctx["verbose"]:
+        print(f"Answer/context embedding agreement: {similarity:.4f}")
+
+    if similarity >= EMBEDDING_CONFIDENT:
+        metrics.increment("confidence", "confident_embedding")
+        return True
+    if similarity <= EMBEDDING_NOT_CONFIDENT:
+        metrics.increment("confidence", "failed_embedding")
         return False
- 
-    additional_responses = generate_multiple_responses(model, prompt, num_samples)
+    return None
+
+
+@confidence_strategy("rouge", cost=10)
+def _rouge_strategy(ctx):
+    samples = ctx.get("samples")
+    try:
+        if samples is not None:
+            additional_responses = samples.result()
+        else:
+            additional_responses = generate_multiple_responses(
+                ctx["model"], ctx["messages"], ctx["num_samples"], ctx["parallelism"]
+            )
+    except OllamaOverloadedError:
+        # Ollama is busy, not the answer wrong: keep the SLM answer rather than escalate
+        if ctx["verbose"]:
+            print("Ollama overloaded, skipping the ROUGE check")
+        metrics.increment("confidence", "samples_overloaded")
+        return None
     
     if not additional_responses:
-        if verbose:
+        if ctx["verbose"]:
             print("Cannot not generate additional samples")
+        metrics.increment("confidence", "no_samples")
         return False
     
-    all_responses = [original_response] + additional_responses
+    all_responses = [ctx["response"]] + additional_responses
     
     confidence_score = calculate_rouge_confidence(all_responses)
+    metrics.observe("rouge_score", float(confidence_score))
     
-    if verbose:
-        print(f"Rouge Confidence Score: {confidence_score:.4f} (threshold: {rouge_threshold})")
+    if ctx["verbose"]:
+        print(f"Rouge Confidence Score: {confidence_score:.4f} (threshold: {ctx['rouge_threshold']})")
     
-    confident = confidence_score >= rouge_threshold
+    confident = confidence_score >= ctx["rouge_threshold"]
+    metrics.increment("confidence", "confident" if confident else "failed_rouge")
     
-    return confident
\ No newline at end of file
+    return confident
+
+
+# Fail at startup rather than on every turn
+for _route, _cascade in [("default", DEFAULT_CONFIDENCE_CASCADE), *ROUTE_CONFIDENCE_CASCADES.items()]:
+    _unknown = [name for name in _cascade if name not in CONFIDENCE_STRATEGIES]
+    if _unknown:
+        raise ValueError(
+            f"Unknown confidence strategies {_unknown} in the {_route} cascade, expected some of {list(CONFIDENCE_STRATEGIES)}"
+        )
+
+
+@metrics.timed("confidence")
+def evaluate_confidence(model, messages, original_response, num_samples=2, rouge_threshold=0.5,
+                        verbose=False, parallelism=None, samples=None, route=None, context=None,
+                        logprobs=None, cascade=None, logprob_only=False):
+    """
+    Decide whether the SLM is confident in `original_response`, its answer to the chat `messages`.
+
+    Runs the strategies in `cascade` (by default the one configured for `route`) from cheapest
+    to most expensive and stops at the first decisive one. If no strategy decides, the answer
+    is treated as confident.
+
+    `logprobs` are the stats from `summarize_logprobs` for the primary generation. With
+    `logprob_only`, the calibrated logprob score replaces ROUGE resampling entirely; ROUGE is
+    only used if the primary generation returned no logprobs or there is no calibration
+    (LOGPROB_CALIBRATION_PATH).
+
+    `samples` may be a `SampleJob` started with `start_sampling` before the primary answer was
+    generated (overlapped mode). It is cancelled if a cheaper strategy decides first.
+    """
+    if logprob_only:
+        cascade = ["verbalized", "logprob", "rouge"]
+    elif cascade is None:
+        cascade = ROUTE_CONFIDENCE_CASCADES.get(route, DEFAULT_CONFIDENCE_CASCADE)
+
+    ctx = {
+        "model": model,
+        "messages": messages,
+        "response": original_response,
+        "num_samples": num_samples,
+        "rouge_threshold": rouge_threshold,
+        "verbose": verbose,
+        "parallelism": parallelism,
+        "samples": samples,
+        "route": route,
+        "context": context,
+        "logprobs": logprobs,
+        "logprob_only": logprob_only,
+    }
+
+    confident = True
+    decided_by = None
+    try:
+        for name in sorted(cascade, key=lambda n: CONFIDENCE_STRATEGIES[n]["cost"]):
+            decision = CONFIDENCE_STRATEGIES[name]["func"](ctx)
+            if decision is not None:
+                confident = decision
+                decided_by = name
+                break
+    finally:
+        if samples is not None and decided_by != "rouge":
+            samples.cancel()
+
+    metrics.increment("confidence_decided_by", decided_by or "none")
+    if verbose:
+        print(f"Confidence decided by: {decided_by or 'none'}")
+
+    return confident
+
+
+def uses_verbalized_check(route=None, cascade=None, logprob_only=False):
+    """Whether `evaluate_confidence` would run the verbalized check with these arguments."""
+    if logprob_only:
+        return True
+    if cascade is None:
+        cascade = ROUTE_CONFIDENCE_CASCADES.get(route, DEFAULT_CONFIDENCE_CASCADE)
+    return "verbalized" in cascade
+
+
+def evaluate_rouge_confidence(model, messages, original_response, num_samples, 
+                              rouge_threshold=0.5, verbose=False, parallelism=None, samples=None):
+    """The original verbalized check followed by ROUGE resampling, without the cheaper strategies."""
+    return evaluate_confidence(
+        model, messages, original_response, num_samples, rouge_threshold, verbose, parallelism, samples,
+        cascade=["verbalized", "rouge"]
+    )
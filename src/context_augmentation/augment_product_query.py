@@ -44,6 +44,14 @@ class ProductRetriever:
         return "\n".join(lines)
         
     
+    def lookup(self, stock_codes):
+        """Products with these StockCodes, formatted like `search`. Empty if none of them exist."""
+        products = list(self._collection.find(
+            {"StockCode": {"$in": list(stock_codes)}},
+            projection={"_id": 0, "embedding": 0}
+        ))
+        return self._format(products) if products else ""
+
     def search(self, embedded_query, top_k=4):
         top_orders = self._vector_search_products(embedded_query=embedded_query)
         return self._format(top_orders)
\ No newline at end of file
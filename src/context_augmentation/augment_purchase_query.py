@@ -1,8 +1,11 @@
 from typing import List, Dict, Any
 from collections import defaultdict
 import re
-from dateparser.search import search_dates
 from datetime import datetime, timedelta
+from src.metrics import metrics
+
+# Invoices are 6 digits, preceded by a "C" for returns (searched in the upper-cased query)
+INVOICE_PATTERN = r"\b([A-Z]?)(\d{6})\b"
 
 class PurchaseRetriever:
     def __init__(self, collection, user_id):
@@ -71,13 +74,14 @@ class PurchaseRetriever:
         """
 
         # Try extracting invoice number directly.
-        pattern = r"\b([A-Z]?)(\d{6})\b"
-        match = re.search(pattern, query.upper())
+        match = re.search(INVOICE_PATTERN, query.upper())
         if match:
             letter, digits = match.groups()
             return f"{letter}{digits}"
  
         # Try extracting date to get invoice number.
+        # dateparser is slow to import, so only load it once a query needs it
+        from dateparser.search import search_dates
         matches = search_dates(query)
         if not matches:
             return None
@@ -211,9 +215,12 @@ class PurchaseRetriever:
         lines.append("")
         return "\n".join(lines)
 
-    def search(self, args, query, embedded_query, user_id, router, top_k=10):
+    def search(self, args, query, embedded_query, user_id, router, top_k=10, route=None):
+        """`route` skips routing when the query's purchases route is already known (see pre_routing.py)."""
 
-        route = router.route_purchases(args, embedded_query)
+        if route is None:
+            route = router.route_purchases(args, embedded_query)
+        metrics.increment("route", f"purchases/{route}")
 
         if route == "item_based":
 
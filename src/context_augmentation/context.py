@@ -1,50 +1,189 @@
+import os
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from typing import List, Dict, Any
 from collections import defaultdict
-from sklearn.metrics.pairwise import cosine_similarity
 
-from sentence_transformers import SentenceTransformer
-hf_model = SentenceTransformer("all-MiniLM-L6-v2")
+from src.metrics import metrics
+from src.embedding_cache import embedding_cache
+from src.embedding_batcher import EmbeddingBatcher, EMBEDDING_MAX_BATCH, EMBEDDING_BATCH_DELAY_MS
+from src.lazy import Lazy
+from src.context_augmentation.pre_routing import pre_router, PRE_ROUTER
+
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# "torch" (default), "onnx", or "onnx-int8" for the dynamically quantized ONNX export that ships
+# with the model. The ONNX backends need `pip install "sentence-transformers[onnx]"`; compare them
+# with tests/benchmark_embedding_backends.py.
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "torch")
+# int8 export to use, matching the CPU: onnx/model_quint8_avx2.onnx, onnx/model_qint8_avx512.onnx,
+# onnx/model_qint8_avx512_vnni.onnx or onnx/model_qint8_arm64.onnx
+EMBEDDING_ONNX_INT8_FILE = os.environ.get("EMBEDDING_ONNX_INT8_FILE", "onnx/model_quint8_avx2.onnx")
+
+# Characters of context kept when the contexts of two routes are merged (see merge_contexts)
+CONTEXT_BUDGET_CHARS = int(os.environ.get("CONTEXT_BUDGET_CHARS", 4000))
+RETRIEVAL_WORKERS = 8  # runner-up retrievals that can run at the same time
+
+_retrieval_pool = None
+_retrieval_pool_lock = threading.Lock()
+
+def load_embedding_model(backend=EMBEDDING_BACKEND):
+    from sentence_transformers import SentenceTransformer
+
+    if backend == "torch":
+        return SentenceTransformer(EMBEDDING_MODEL)
+    if backend == "onnx":
+        return SentenceTransformer(EMBEDDING_MODEL, backend="onnx")
+    if backend == "onnx-int8":
+        return SentenceTransformer(EMBEDDING_MODEL, backend="onnx", model_kwargs={"file_name": EMBEDDING_ONNX_INT8_FILE})
+    raise ValueError(f"Unknown EMBEDDING_BACKEND {backend!r}, expected 'torch', 'onnx' or 'onnx-int8'")
+
+hf_model = Lazy("sentence_transformer", load_embedding_model)
+
+# Embeddings from different backends differ slightly, so they are cached separately
+_cache_model = EMBEDDING_MODEL if EMBEDDING_BACKEND == "torch" else f"{EMBEDDING_MODEL}@{EMBEDDING_BACKEND}"
+
+def encode_batch(texts: List[str]) -> np.ndarray:
+    return hf_model.get().encode(
+        texts, batch_size=len(texts), normalize_embeddings=True, convert_to_numpy=True
+    ).astype("float32")
+
+# Concurrent requests (API server) share one encode call, see src/embedding_batcher.py
+embedding_batcher = EmbeddingBatcher(encode_batch, EMBEDDING_MAX_BATCH, EMBEDDING_BATCH_DELAY_MS / 1000)
 
 def embed_text(text: str) -> np.ndarray:
     """
     Given some text, return an encodded array using the 'all-MiniLM-L6-v2' huggingface model.
+    Embeddings are cached (see src/embedding_cache.py), so the returned array is read-only.
     """
-    return hf_model.encode(text, normalize_embeddings=True).astype("float32")
+    return embedding_cache.get_or_compute(_cache_model, text, embedding_batcher.encode)
    
 def get_query_context(args, user_id, query, retrievers, router, top_k=10):
+    return retrieve_query_context(args, user_id, query, retrievers, router, top_k)["context"]
 
-    query_embedding = embed_text(query)
-    
-    start_time = time.time()
-    route = router.route_collection(args, query_embedding)
-    end_time = time.time()
-
-    if (args.verbose):
-        print("\t[DEBUG] Routing Time: ", end_time-start_time)
-
-    start_time = time.time()
-    context = ""
-
+def _retrieve(args, user_id, query, query_embedding, route, retrievers, router, rule=None):
+    """Context for `query` from the retriever of `route`, or None if there is no such route."""
     if route == "purchases":
         purchases_retriever = retrievers["purchases"]
-        context = purchases_retriever.search(args, query, query_embedding, user_id, router)
+        purchases_route = rule.get("purchases_route") if rule else None
+        return purchases_retriever.search(args, query, query_embedding, user_id, router, route=purchases_route)
     elif route == "products":
         products_retriever = retrievers["products"]
-        context = products_retriever.search(query_embedding)
+        context = products_retriever.lookup(rule["stock_codes"]) if rule else ""
+        if not context:
+            context = products_retriever.search(query_embedding if query_embedding is not None else embed_text(query))
+        return context
     elif route == "faq":
         faq_retriever = retrievers["faq"]
-        context = faq_retriever.search(query_embedding)
-        
+        return faq_retriever.search(query_embedding)
+    return None
+
+def _truncate(context, limit):
+    """Cut `context` to at most `limit` characters, at a line break when there is one."""
+    if len(context) <= limit:
+        return context
+    cut = context.rfind("\n", 0, limit)
+    return context[:cut if cut > 0 else limit]
+
+def merge_contexts(primary, secondary, second_route, budget=CONTEXT_BUDGET_CHARS):
+    """
+    Context of the chosen route followed by the runner-up's, within `budget` characters.
+    The runner-up gets at most half of the budget, and less if the chosen route needs more.
+    """
+    secondary = _truncate(secondary, min(budget // 2, max(0, budget - len(primary))))
+    primary = _truncate(primary, budget - len(secondary))
+    if not secondary.strip():
+        return primary
+    return f"{primary}\n\nPossibly relevant ({second_route}):\n{secondary}"
+
+def _start_retrieval(*retrieve_args):
+    """Run `_retrieve` on the retrieval pool, recording its timings into the caller's turn."""
+    global _retrieval_pool
+    if _retrieval_pool is None:
+        with _retrieval_pool_lock:
+            if _retrieval_pool is None:
+                _retrieval_pool = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
+
+    turn = metrics.current_turn()
+
+    def run():
+        with metrics.turn(turn):
+            return _retrieve(*retrieve_args)
+
+    return _retrieval_pool.submit(run)
+
+def retrieve_query_context(args, user_id, query, retrievers, router, top_k=10):
+    """
+    Same as `get_query_context`, but returns a dict with the retrieved `context` together with
+    the `route` it was retrieved from, the `query_embedding` used for routing and retrieval and
+    the router's full result (`routing`: every route's score and the top-1/top-2 margin).
+
+    Queries with an obvious route (an invoice number, a product's StockCode...) are routed by
+    the rules in pre_routing.py instead; `rule` is then the rule that fired, and `routing` and
+    `query_embedding` are None unless the retriever still needed the embedding.
+
+    When the router can hardly tell the top two routes apart (see `Router.is_ambiguous`), the
+    runner-up's context is retrieved at the same time and appended (`merge_contexts`).
+    `routes` lists the routes the context came from.
+    """
+    rule = None
+    if getattr(args, "pre_router", PRE_ROUTER):
+        with metrics.timer("pre_routing"):
+            rule = pre_router.get().match(query)
+
+    query_embedding = None
+    if rule is None:
+        with metrics.timer("embedding"):
+            query_embedding = embed_text(query)
+
+        start_time = time.time()
+        route = router.route_collection(args, query_embedding)
+        end_time = time.time()
+        metrics.observe("routing", end_time - start_time)
+
+        if (args.verbose):
+            print("\t[DEBUG] Routing Time: ", end_time-start_time)
     else:
+        route = router.route_by_rule(rule)
+
+        if (args.verbose):
+            print(f"\t[DEBUG] Routed to {route} by the {rule['rule']} rule")
+
+    metrics.increment("route", route)
+    routing = getattr(router, "last_result", None)
+
+    start_time = time.time()
+
+    second = None
+    if rule is None and route in retrievers and router.is_ambiguous(routing) and routing["second_route"] in retrievers:
+        second_route = routing["second_route"]
+        second = _start_retrieval(args, user_id, query, query_embedding, second_route, retrievers, router)
+        metrics.increment("top2_retrieval", f"{route}+{second_route}")
+
+        if (args.verbose):
+            print(f"\t[DEBUG] Ambiguous route (margin {routing['margin']:.3f}), also retrieving from {second_route}")
+
+    context = _retrieve(args, user_id, query, query_embedding, route, retrievers, router, rule)
+    if context is None:
         print(f"Warning: Route {route} does not exist. Skipping data augmentation")
-        return query
+        return {"context": query, "route": route, "routes": [route], "query_embedding": query_embedding, "routing": routing, "rule": rule}
+
+    routes = [route]
+    if second is not None:
+        try:
+            context = merge_contexts(context, second.result(), second_route)
+            routes.append(second_route)
+        except Exception as e:
+            # The winner's context is enough to answer with
+            metrics.increment("top2_retrieval_failed", second_route)
+            if (args.verbose):
+                print(f"\t[DEBUG] Retrieval from {second_route} failed: {e}")
     end_time = time.time()
+    metrics.observe("context_retrieval", end_time - start_time)
+
     if(args.verbose):
         print("\t[DEBUG] Context Retrieval Time: ", end_time-start_time)
 
-    return context
-
-    
-
+    return {"context": context, "route": route, "routes": routes, "query_embedding": query_embedding, "routing": routing, "rule": rule}
@@ -0,0 +1,117 @@
+import os
+import re
+import csv
+import threading
+
+from src.metrics import metrics
+from src.lazy import Lazy
+
+PRE_ROUTER = os.environ.get("PRE_ROUTER", "1") == "1"
+BUSINESS_DATA_PATH = os.environ.get("BUSINESS_DATA_PATH", "data/business_data.csv")
+
+# An invoice number after "invoice", "order", "receipt" or "#", or a cancellation (C536379).
+# A bare six-digit number could as well be a quantity, a price or a postcode.
+INVOICE_PATTERN = r"\b(invoice|order|receipt)\s*(number|no\.?|nr\.?)?[\s:#]*\d{6}\b|#\s*\d{6}\b|\bC\d{6}\b"
+# "my latest order", but not "when did I last order a mug" or "my latest order of pet food" (item questions)
+LATEST_ORDER_PATTERN = r"\b(my|the)\s+(latest|last|most recent|newest)\s+(order|purchase|invoice|delivery|package|shipment)\b(?!\s+(of|for)\b)"
+STOCK_CODE_PATTERN = r"\b\d{5}[A-Z]{0,2}\b"
+# A product mentioned in a question about the user's own purchases is left to the embedding router
+PURCHASE_HISTORY_PATTERN = r"\b(i|we)\s+(bought|ordered|purchased|returned|received|got)\b|\b(did|have|had)\s+(i|we)\b|\bmy\s+(orders?|purchases?|returns?)\b"
+
+MIN_TITLE_WORDS = 2  # shorter titles ("POSTAGE", "found") are ordinary words
+
+
+def _words(text):
+    return re.findall(r"[A-Z0-9]+", text.upper())
+
+
+class PreRouter:
+    """
+    Deterministic rules tried before the embedding router, for queries whose route is obvious:
+
+    - `invoice`: an invoice number ("invoice 536392", "order #536392", C536379) -> purchases/order_based
+    - `latest_order`: "my latest order", "the last purchase", ... -> purchases/order_based
+    - `stock_code`: a StockCode of the catalog (85123A) -> products
+    - `product_title`: the exact title of a product ("white hanging heart t-light holder") -> products
+
+    The product rules don't fire on questions about the user's own purchases ("did I order ..."),
+    those need the embedding router to choose between products and purchases.
+    `match(query)` returns the first rule that fires, or None.
+    """
+
+    def __init__(self, products):
+        """`products` maps StockCode to Title."""
+        self.stock_codes = {}  # upper-cased StockCode -> StockCodes (the catalog has both 85123A and 85123a)
+        self.titles = {}  # title words joined by spaces -> StockCodes
+        self.max_title_words = 0
+
+        for stock_code, title in products.items():
+            # Codes without digits are fees and adjustments (POST, M, BANK CHARGES...), not products
+            if not re.search(r"\d", stock_code):
+                continue
+            self.stock_codes.setdefault(stock_code.upper(), []).append(stock_code)
+
+            words = _words(title)
+            if len(words) >= MIN_TITLE_WORDS:
+                self.titles.setdefault(" ".join(words), []).append(stock_code)
+                self.max_title_words = max(self.max_title_words, len(words))
+
+        self.hits = {rule: 0 for rule in ("invoice", "latest_order", "stock_code", "product_title")}
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_csv(cls, path):
+        with open(path, newline="", encoding="utf-8", errors="replace") as f:
+            return cls({row["StockCode"]: row["Title"] for row in csv.DictReader(f) if row["Title"]})
+
+    def _match_products(self, query):
+        codes = [code for c in re.findall(STOCK_CODE_PATTERN, query.upper()) for code in self.stock_codes.get(c, [])]
+        if codes:
+            return "stock_code", codes
+
+        # Every run of up to `max_title_words` words of the query, longest first
+        words = _words(query)
+        for n in range(min(self.max_title_words, len(words)), MIN_TITLE_WORDS - 1, -1):
+            for i in range(len(words) - n + 1):
+                codes = self.titles.get(" ".join(words[i:i + n]))
+                if codes:
+                    return "product_title", list(codes)
+
+        return None, None
+
+    def match(self, query):
+        """
+        Returns a dict with the `rule` that fired, the collection `route`, the `purchases_route`
+        (for purchases) and the matched `stock_codes` (for products), or None.
+        """
+        result = None
+
+        if re.search(INVOICE_PATTERN, query, re.IGNORECASE):
+            result = {"rule": "invoice", "route": "purchases", "purchases_route": "order_based"}
+        elif re.search(LATEST_ORDER_PATTERN, query, re.IGNORECASE):
+            result = {"rule": "latest_order", "route": "purchases", "purchases_route": "order_based"}
+        elif not re.search(PURCHASE_HISTORY_PATTERN, query, re.IGNORECASE):
+            rule, codes = self._match_products(query)
+            if rule:
+                result = {"rule": rule, "route": "products", "stock_codes": codes}
+
+        with self._lock:
+            if result:
+                self.hits[result["rule"]] += 1
+            else:
+                self.misses += 1
+        metrics.increment("pre_router", result["rule"] if result else "none")
+        return result
+
+    def stats(self):
+        with self._lock:
+            total = sum(self.hits.values()) + self.misses
+            return {
+                "hits": dict(self.hits),
+                "misses": self.misses,
+                "hit_rate": sum(self.hits.values()) / total if total else None,
+            }
+
+
+pre_router = Lazy("pre_router", lambda: PreRouter.from_csv(BUSINESS_DATA_PATH))
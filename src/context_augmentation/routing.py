@@ -1,37 +1,392 @@
+import os
+import time
+import threading
+
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
+
+from src.metrics import metrics
+
+# "centroid": compare queries with the averaged example embedding of each route.
+# "knn": weighted vote of the nearest individual examples, see KNNRouteTable.
+ROUTER_MODE = os.environ.get("ROUTER_MODE", "centroid")
+ROUTER_KNN_K = int(os.environ.get("ROUTER_KNN_K", 7))
+ROUTER_KNN_TEMPERATURE = float(os.environ.get("ROUTER_KNN_TEMPERATURE", 0.05))  # lower = nearest examples weigh more
+ROUTER_MAX_ONLINE_EXEMPLARS = int(os.environ.get("ROUTER_MAX_ONLINE_EXEMPLARS", 200))  # per route
+# Learn from turns the SLM answered confidently by adding their query as an exemplar of its route
+ROUTER_LEARN_ONLINE = os.environ.get("ROUTER_LEARN_ONLINE", "0") == "1"
+ROUTER_DUPLICATE_SIMILARITY = 0.98  # online exemplars this close to an existing one are not added
+# Below these top-1/top-2 margins, context is retrieved from both routes (0 = never). The first is a
+# difference of cosine similarities (centroid router), the second of vote shares (k-NN router).
+ROUTER_AMBIGUOUS_MARGIN = float(os.environ.get("ROUTER_AMBIGUOUS_MARGIN", 0.02))
+ROUTER_AMBIGUOUS_VOTE_MARGIN = float(os.environ.get("ROUTER_AMBIGUOUS_VOTE_MARGIN", 0.2))
+# Seconds between checks whether the routing collections changed (0 = load them once)
+ROUTING_REFRESH_INTERVAL = float(os.environ.get("ROUTING_REFRESH_INTERVAL", 300))
+ROUTING_VERSIONS_COLLECTION = "routing_versions"  # one {_id: <collection name>, checksum} per routing collection
+
+
+class RouteTable:
+    """
+    Route embeddings of one routing collection, stacked into a single L2-normalized float32
+    matrix so that scoring queries against every route is one matrix product.
+    """
+
+    def __init__(self, route_embeddings):
+        self.routes = list(route_embeddings)
+        matrix = np.array([route_embeddings[route] for route in self.routes], dtype=np.float32)
+        self.matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+    @classmethod
+    def from_collection(cls, collection):
+        return cls({doc['route']: doc['embedding'] for doc in collection.find()})
+
+    def scores(self, query_embeddings):
+        """Cosine similarity of each query (rows of a 2-D array) with each route."""
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        return queries @ self.matrix.T
+
+    def classify(self, query_embeddings):
+        """
+        Route every query. Returns one dict per query with the best `route` and its `score`,
+        the runner-up (`second_route`), the `margin` between their scores and the score of
+        every route (`scores`).
+        """
+        scores = self.scores(query_embeddings)
+        ranked = np.argsort(-scores, axis=1)
+
+        results = []
+        for row, order in zip(scores, ranked):
+            second = order[1] if len(order) > 1 else None
+            results.append({
+                "route": self.routes[order[0]],
+                "score": float(row[order[0]]),
+                "second_route": self.routes[second] if second is not None else None,
+                "margin": float(row[order[0]] - row[second]) if second is not None else float("inf"),
+                "scores": dict(zip(self.routes, row.tolist())),
+            })
+        return results
+
+
+def _encode_examples(examples):
+    # Imported here, routing itself doesn't need the embedding model
+    from src.context_augmentation.context import encode_batch
+    return encode_batch(list(examples))
+
+
+class KNNRouteTable:
+    """
+    Routes by a weighted vote of the `k` example queries closest to the query, instead of
+    comparing it with one averaged embedding per route. Keeps queries near the border between
+    two routes with the route of their closest examples.
+
+    Each neighbour votes with weight exp(similarity / `temperature`). The vote share of the
+    winning route is its `score`. Below `abstain_threshold`, the vote abstains and the
+    `fallback` (the centroid `RouteTable`) decides; the result then has `abstained` set. The
+    threshold is learned from the examples themselves (`fit_abstain_threshold`) unless given.
+
+    Exemplars can be added while serving (`add_exemplar`), e.g. from queries that were answered
+    confidently. Only the `max_online` most recent online exemplars of a route are kept.
+    """
+
+    def __init__(self, exemplars, k=7, temperature=0.05, fallback=None, abstain_threshold=None, max_online=200):
+        self.routes = list(exemplars)
+        self.k = k
+        self.temperature = temperature
+        self.fallback = fallback
+        self.max_online = max_online
+
+        embeddings, labels = [], []
+        for i, route in enumerate(self.routes):
+            for embedding in exemplars[route]:
+                embeddings.append(embedding)
+                labels.append(i)
+
+        matrix = np.array(embeddings, dtype=np.float32)
+        matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+
+        # (matrix, labels, online) is replaced as a whole, so readers never see a half-updated index
+        self._index = (matrix, np.array(labels), np.zeros(len(labels), dtype=bool))
+        self._lock = threading.Lock()
+
+        if abstain_threshold is None:
+            abstain_threshold = self.fit_abstain_threshold() if fallback is not None else 0.0
+        self.abstain_threshold = abstain_threshold
+
+    @classmethod
+    def from_collection(cls, collection, **kwargs):
+        """
+        Build from a routing collection. Uses the documents' `example_embeddings` when present
+        (written by the generate_*_routing_embeddings.py scripts), otherwise embeds their `examples`.
+        """
+        exemplars, centroids = {}, {}
+        for doc in collection.find():
+            embeddings = doc.get('example_embeddings') or _encode_examples(doc['examples'])
+            exemplars[doc['route']] = embeddings
+            centroids[doc['route']] = doc['embedding']
+        return cls(exemplars, fallback=RouteTable(centroids), **kwargs)
+
+    @property
+    def size(self):
+        return len(self._index[1])
+
+    def _vote(self, scores, labels):
+        """Per-route vote shares (rows sum to 1) from the similarity of each query to each exemplar."""
+        k = min(self.k, scores.shape[1])
+        nearest = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        similarities = np.take_along_axis(scores, nearest, axis=1)
+        weights = np.exp((similarities - similarities.max(axis=1, keepdims=True)) / self.temperature)
+
+        shares = np.zeros((len(scores), len(self.routes)), dtype=np.float64)
+        np.add.at(shares, (np.arange(len(scores))[:, None], labels[nearest]), weights)
+        return shares / shares.sum(axis=1, keepdims=True)
+
+    def classify(self, query_embeddings):
+        """Same results as `RouteTable.classify`, with vote shares as scores and an `abstained` flag."""
+        matrix, labels, _ = self._index
+        queries = np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32))
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+
+        shares = self._vote(queries @ matrix.T, labels)
+        ranked = np.argsort(-shares, axis=1)
+
+        abstaining = [i for i, order in enumerate(ranked) if shares[i, order[0]] < self.abstain_threshold]
+        fallback_results = {}
+        if abstaining and self.fallback is not None:
+            fallback_results = dict(zip(abstaining, self.fallback.classify(queries[abstaining])))
+
+        results = []
+        for i, (row, order) in enumerate(zip(shares, ranked)):
+            if i in fallback_results:
+                results.append({**fallback_results[i], "abstained": True})
+                continue
+
+            second = order[1] if len(order) > 1 else None
+            results.append({
+                "route": self.routes[order[0]],
+                "score": float(row[order[0]]),
+                "second_route": self.routes[second] if second is not None else None,
+                "margin": float(row[order[0]] - row[second]) if second is not None else float("inf"),
+                "scores": dict(zip(self.routes, row.tolist())),
+                "abstained": False,
+            })
+        return results
+
+    def fit_abstain_threshold(self):
+        """
+        Leave-one-out over the exemplars: pick the vote share below which deferring to the
+        fallback router makes the fewest routing errors.
+        """
+        matrix, labels, _ = self._index
+        scores = matrix @ matrix.T
+        np.fill_diagonal(scores, -np.inf)  # an exemplar must not vote for itself
+
+        shares = self._vote(scores, labels)
+        confidence = shares.max(axis=1)
+        knn_correct = shares.argmax(axis=1) == labels
+
+        fallback_routes = [r["route"] for r in self.fallback.classify(matrix)]
+        fallback_correct = np.array([self.routes[label] == route for label, route in zip(labels, fallback_routes)])
+
+        best_threshold, best_errors = 0.0, None
+        for threshold in np.concatenate([[0.0], np.unique(confidence) + 1e-9]):
+            use_knn = confidence >= threshold
+            errors = np.sum(np.where(use_knn, ~knn_correct, ~fallback_correct))
+            if best_errors is None or errors < best_errors:
+                best_threshold, best_errors = float(threshold), errors
+        return best_threshold
+
+    def add_exemplar(self, route, embedding):
+        """Add an example query for `route`. Returns False if it's unknown or a near duplicate."""
+        if route not in self.routes:
+            return False
+
+        embedding = np.asarray(embedding, dtype=np.float32)
+        embedding = embedding / max(np.linalg.norm(embedding), 1e-12)
+
+        with self._lock:
+            matrix, labels, online = self._index
+            if len(matrix) and float(np.max(matrix @ embedding)) >= ROUTER_DUPLICATE_SIMILARITY:
+                return False
+
+            label = self.routes.index(route)
+            matrix = np.vstack([matrix, embedding[None, :]])
+            labels = np.append(labels, label)
+            online = np.append(online, True)
+
+            route_online = np.flatnonzero(online & (labels == label))
+            if len(route_online) > self.max_online:
+                keep = np.ones(len(labels), dtype=bool)
+                keep[route_online[:len(route_online) - self.max_online]] = False
+                matrix, labels, online = matrix[keep], labels[keep], online[keep]
+
+            self._index = (matrix, labels, online)
+
+        metrics.increment("router_exemplars_added", route)
+        return True
+
+
+def _table_builder(mode):
+    if mode == "knn":
+        def build(collection):
+            return KNNRouteTable.from_collection(
+                collection, k=ROUTER_KNN_K, temperature=ROUTER_KNN_TEMPERATURE, max_online=ROUTER_MAX_ONLINE_EXEMPLARS
+            )
+        return build
+    if mode == "centroid":
+        return RouteTable.from_collection
+    raise ValueError(f"Unknown ROUTER_MODE {mode!r}, expected 'centroid' or 'knn'")
+
+
+class RoutingTables:
+    """
+    Route tables of both routing collections, loaded once per process and shared by the Router
+    of every session.
+
+    Every `refresh_interval` seconds a background thread reads the version of the routing data
+    and rebuilds the tables only if it changed. The version is the checksum the
+    generate_*_routing_embeddings.py scripts write to `routing_versions`, or the ids of the
+    routing documents for databases generated before that (the scripts replace every document).
+    The new tables replace the old ones in a single assignment, so a reader sees either the old
+    or the new tables, never a mix. Exemplars learned online are dropped on reload.
+    """
+
+    shared_across_sessions = True  # not counted in a session's size, see src/session_store.py
+
+    def __init__(self, collection_routing, purchases_routing, mode=None, refresh_interval=ROUTING_REFRESH_INTERVAL):
+        self.collections = {
+            "collection": collection_routing,
+            "purchases": purchases_routing,
+        }
+        self.mode = mode or ROUTER_MODE
+        self.refresh_interval = refresh_interval
+        self._build = _table_builder(self.mode)
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self.reloads = 0
+        self.refresh_errors = 0
+
+        self.version = self._read_version()
+        self.tables = self._load()
+        self.loaded_at = time.time()
+        self._start_refresh()
+
+    def _load(self):
+        return {name: self._build(collection) for name, collection in self.collections.items()}
+
+    def _read_version(self):
+        names = [collection.name for collection in self.collections.values()]
+        versions_collection = self.collections["collection"].database[ROUTING_VERSIONS_COLLECTION]
+        checksums = {doc["_id"]: doc.get("checksum") for doc in versions_collection.find({"_id": {"$in": names}})}
+
+        version = []
+        for collection in self.collections.values():
+            if checksums.get(collection.name):
+                version.append(checksums[collection.name])
+            else:
+                version.append(tuple(sorted(str(doc["_id"]) for doc in collection.find({}, {"_id": 1}))))
+        return tuple(version)
+
+    def refresh(self):
+        """Reload the tables if the routing data changed. Returns True if they were reloaded."""
+        with self._lock:
+            version = self._read_version()
+            if version == self.version:
+                return False
+
+            tables = self._load()
+            self.tables = tables
+            self.version = version
+            self.loaded_at = time.time()
+            self.reloads += 1
+
+        metrics.increment("routing_tables_reloaded")
+        return True
+
+    def _start_refresh(self):
+        if self.refresh_interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._refresh_loop, name="routing-refresh", daemon=True)
+        self._thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception:
+                # Keep routing with the tables we have, MongoDB may just be unreachable for a while
+                with self._lock:
+                    self.refresh_errors += 1
+                metrics.increment("routing_tables_refresh_failed")
+
+    def stats(self):
+        tables = self.tables
+        return {
+            "mode": self.mode,
+            "routes": {name: len(table.routes) for name, table in tables.items()},
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "refresh_errors": self.refresh_errors,
+        }
+
 
 class Router:
+    """Per-session routing state over the shared `RoutingTables`."""
 
-    def __init__(self, collection_routing, purchases_routing):
-        self._route_embeddings = {}
-        for doc in collection_routing.find():
-            self._route_embeddings[doc['route']] = np.array(doc['embedding'])
-        
-        self._purchases_route_embeddings = {}
-        for doc in purchases_routing.find():
-            self._purchases_route_embeddings[doc['route']] = np.array(doc['embedding'])
-
-    def _router(self, args, query_embedding, db_embeddings):
-        similarities = {}
-        for route, embedding in db_embeddings.items():
-            similarity = cosine_similarity(
-                query_embedding.reshape(1, -1),
-                embedding.reshape(1, -1)
-            )[0][0]
-            similarities[route] = similarity
-
-        best_route = max(similarities, key=similarities.get)
-        best_score = similarities[best_route]
+    def __init__(self, tables):
+        self.tables = tables
+        self.last_route = None
+        self.last_result = None
+        self.mode = tables.mode
+        self.learn_online = ROUTER_LEARN_ONLINE and self.mode == "knn"
 
-        if args.verbose:
-            print(f"\t[DEBUG] Routed to {best_route} with confidence {best_score}")
+    def classify(self, query_embedding, table="collection"):
+        """Full routing result for one query, see `RouteTable.classify`."""
+        return self.tables.tables[table].classify(query_embedding)[0]
+
+    def classify_batch(self, query_embeddings, table="collection"):
+        """Route many queries (rows of a 2-D array) with one matrix product."""
+        return self.tables.tables[table].classify(query_embeddings)
+
+    def add_exemplar(self, route, query_embedding, table="collection"):
+        """Teach the k-NN router that `query_embedding` belongs to `route`. No-op for the centroid router."""
+        route_table = self.tables.tables[table]
+        if not hasattr(route_table, "add_exemplar"):
+            return False
+        return route_table.add_exemplar(route, query_embedding)
 
-        return best_route
+    def _router(self, args, query_embedding, table):
+        result = self.classify(query_embedding, table)
+        if result["second_route"] is not None:
+            metrics.observe(f"route_margin_{table}", result["margin"])
+        if result.get("abstained"):
+            metrics.increment("router_abstained", table)
 
+        if args.verbose:
+            print(f"\t[DEBUG] Routed to {result['route']} with confidence {result['score']} (margin {result['margin']:.3f})")
+
+        return result
 
     def route_collection(self, args, query_embedding):
-        return self._router(args, query_embedding, self._route_embeddings)
+        self.last_result = self._router(args, query_embedding, "collection")
+        self.last_route = self.last_result["route"]
+        return self.last_route
+
+    def is_ambiguous(self, result):
+        """Whether the top two routes of a routing `result` are too close to pick one."""
+        if result is None or result["second_route"] is None:
+            return False
+        # Abstained k-NN results come from the centroid fallback, so their margin is a cosine one
+        if self.mode == "knn" and not result.get("abstained"):
+            return result["margin"] < ROUTER_AMBIGUOUS_VOTE_MARGIN
+        return result["margin"] < ROUTER_AMBIGUOUS_MARGIN
+
+    def route_by_rule(self, rule):
+        """Record a route decided by a pre-routing rule (see pre_routing.py) instead of by embedding."""
+        self.last_result = None
+        self.last_route = rule["route"]
+        return self.last_route
 
     def route_purchases(self, args, query_embedding):
-        return self._router(args, query_embedding, self._purchases_route_embeddings) 
+        return self._router(args, query_embedding, "purchases")["route"]
@@ -0,0 +1,121 @@
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+from src.metrics import metrics
+
+EMBEDDING_BATCH_DELAY_MS = float(os.environ.get("EMBEDDING_BATCH_DELAY_MS", 5))  # 0 = no batching
+EMBEDDING_MAX_BATCH = int(os.environ.get("EMBEDDING_MAX_BATCH", 64))
+
+
+class EmbeddingBatcher:
+    """
+    Groups concurrent encode calls into batches.
+
+    `encode(text)` from a caller with no other call in progress encodes right away on the
+    calling thread, so a lone caller (the CLI, an idle server) never waits. Calls made while
+    another one is in progress are queued: a worker thread takes the oldest queued text, waits up
+    to `max_delay` seconds after it arrived for more (or until `max_batch_size` texts are queued),
+    encodes them with one `encode_batch(texts)` call and hands each caller its row. Identical
+    texts in a batch are encoded once.
+
+    With `max_delay` <= 0 texts are always encoded one by one on the calling thread.
+    """
+
+    def __init__(self, encode_batch, max_batch_size=64, max_delay=0.005):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+
+        self.batches = 0
+        self.texts = 0
+        self.in_progress = 0  # encode calls that have not returned yet
+
+    def encode(self, text):
+        if self.max_delay <= 0:
+            return self.encode_batch([text])[0]
+
+        with self._lock:
+            self.in_progress += 1
+            alone = self.in_progress == 1
+        try:
+            if alone:
+                # Nobody to batch with, don't wait for anyone
+                start_time = time.time()
+                embedding = self.encode_batch([text])[0]
+                self._record([0.0], time.time() - start_time)
+                return embedding
+
+            self._start_worker()
+            future = Future()
+            self._queue.put((text, future, time.time()))
+            return future.result()
+        finally:
+            with self._lock:
+                self.in_progress -= 1
+
+    def _record(self, queue_delays, batch_time):
+        for delay in queue_delays:
+            metrics.observe("embedding_queue_delay", delay)
+        metrics.observe("embedding_batch_size", len(queue_delays))
+        metrics.observe("embedding_batch_time", batch_time)
+        with self._lock:
+            self.batches += 1
+            self.texts += len(queue_delays)
+
+    def _start_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+                self._worker.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_delay
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.time()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            start_time = time.time()
+
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            try:
+                embeddings = self.encode_batch(texts)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            rows = dict(zip(texts, embeddings))
+            for text, future, _ in batch:
+                future.set_result(rows[text])
+
+            self._record([start_time - queued_at for _, _, queued_at in batch], time.time() - start_time)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_delay": self.max_delay,
+                "batches": self.batches,
+                "texts": self.texts,
+                "avg_batch_size": self.texts / self.batches if self.batches else None,
+                "queued": self._queue.qsize(),
+            }
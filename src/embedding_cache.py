@@ -0,0 +1,136 @@
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from src.metrics import metrics
+
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get("EMBEDDING_CACHE_MAX_ENTRIES", 10000))  # kept in memory
+EMBEDDING_CACHE_PATH = os.environ.get("EMBEDDING_CACHE_PATH")  # sqlite file, unset = memory only
+
+
+def normalize_text(text, lowercase=False):
+    """Key text the way the tokenizer sees it: NFC, trimmed, runs of whitespace collapsed."""
+    text = unicodedata.normalize("NFC", text)
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.lower() if lowercase else text
+
+
+class EmbeddingCache:
+    """
+    LRU cache of text embeddings, keyed by model name and normalized text.
+
+    The `max_entries` most recently used embeddings are kept in memory. With a `path`, every
+    embedding is also written to a sqlite database there, which is read on memory misses, so
+    embeddings survive restarts and are shared by processes using the same file.
+
+    `lowercase_models` are models with an uncased tokenizer, for which "Where is my order?"
+    and "where is my order?" share an entry. Model names may carry a backend suffix
+    (e.g. "all-MiniLM-L6-v2@onnx-int8"), which is ignored for this.
+    """
+
+    def __init__(self, max_entries=10000, path=None, lowercase_models=()):
+        self.max_entries = max_entries
+        self.path = path
+        self.lowercase_models = set(lowercase_models)
+
+        self._entries = OrderedDict()  # (model, text) -> embedding, least recently used first
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text TEXT NOT NULL, vector BLOB NOT NULL, "
+                "PRIMARY KEY (model, text))"
+            )
+            self._db.commit()
+
+    def _key(self, model, text):
+        lowercase = model.split("@")[0] in self.lowercase_models
+        return model, normalize_text(text, lowercase=lowercase)
+
+    def _remember_locked(self, key, embedding):
+        self._entries[key] = embedding
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, model, text):
+        """Return the cached embedding of `text`, or None."""
+        key = self._key(model, text)
+
+        with self._lock:
+            embedding = self._entries.get(key)
+            if embedding is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                metrics.increment("embedding_cache", "hit")
+                return embedding
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE model = ? AND text = ?", key
+                ).fetchone()
+                if row is not None:
+                    embedding = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember_locked(key, embedding)
+                    self.disk_hits += 1
+                    metrics.increment("embedding_cache", "disk_hit")
+                    return embedding
+
+            self.misses += 1
+            metrics.increment("embedding_cache", "miss")
+            return None
+
+    def put(self, model, text, embedding):
+        key = self._key(model, text)
+        embedding = np.array(embedding, dtype=np.float32)
+        # Shared by every caller that hits this entry, so it must not be changed in place
+        embedding.flags.writeable = False
+
+        with self._lock:
+            self._remember_locked(key, embedding)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (model, text, vector) VALUES (?, ?, ?)",
+                    (*key, embedding.tobytes())
+                )
+                self._db.commit()
+
+        return embedding
+
+    def get_or_compute(self, model, text, compute):
+        """Return the cached embedding of `text`, computing and caching it with `compute(text)` on a miss."""
+        embedding = self.get(model, text)
+        if embedding is None:
+            embedding = self.put(model, text, compute(text))
+        return embedding
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else None,
+                "path": self.path,
+            }
+
+
+# all-MiniLM-L6-v2 uses an uncased tokenizer, so the case of the text doesn't change its embedding
+embedding_cache = EmbeddingCache(
+    EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_PATH, lowercase_models=["all-MiniLM-L6-v2"]
+)
@@ -0,0 +1,38 @@
+import time
+import threading
+
+from src.metrics import metrics
+
+
+class Lazy:
+    """
+    Thread-safe, load-once holder for an expensive resource (a model, a database client...).
+
+    `loader` runs on the first `get()`, so importing the module that defines the resource stays
+    cheap. Concurrent first calls wait for the same load instead of loading twice. The load time
+    is recorded as the `load_<name>` metric.
+    """
+
+    def __init__(self, name, loader):
+        self.name = name
+        self._loader = loader
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._loaded:
+            return self._value
+
+        with self._lock:
+            if not self._loaded:
+                start_time = time.time()
+                self._value = self._loader()
+                self._loaded = True
+                metrics.observe(f"load_{self.name}", time.time() - start_time)
+
+        return self._value
+
+    @property
+    def loaded(self):
+        return self._loaded
@@ -1,18 +1,21 @@
 import re
 import time
-import spacy
 import os
-import certifi
-from pymongo import MongoClient
 
 import json
 import datetime
 
-from src.models.slm import warmup_model, stream_response
-from src.models.llm import llm_response
-
-from src.context_augmentation.context import get_query_context
-from src.context_augmentation.routing import Router
+from src.models.slm import stream_response, build_messages, SYSTEM_PROMPT
+from src.models.llm import llm_response, start_llm_response, LLMDeadlineExceeded
+from src.models.sinks import StdoutSink
+from src.models.lifecycle import model_lifecycle
+from src.answer_cache import answer_cache
+from src.metrics import metrics
+from src.lazy import Lazy
+
+from src.context_augmentation.context import retrieve_query_context, embed_text
+from src.context_augmentation.routing import Router, RoutingTables
+from src.context_augmentation.pre_routing import pre_router
 from src.context_augmentation.augment_purchase_query import PurchaseRetriever
 from src.context_augmentation.augment_product_query import ProductRetriever
 from src.context_augmentation.augment_faq_query import FAQRetriever
@@ -22,19 +25,44 @@ CUSTOMER_TABLE = "purchases"
 BUSINESS_TABLE = "products"
 CUSTOMER_COL = "purchases_columns_meta"
 
-# Create a shared environment across all connections
-_client = MongoClient(os.environ["MONGO_URI"], tls=True, tlsCAFile=certifi.where())
+MAX_SAVED_PROMPT = 0 # currently disable any saved prompt
+
+def _connect_mongo():
+    import certifi
+    from pymongo import MongoClient
+    return MongoClient(os.environ["MONGO_URI"], tls=True, tlsCAFile=certifi.where())
+
+def _load_spacy():
+    #python -m spacy download en_core_web_sm
+    import spacy
+    return spacy.load("en_core_web_sm")
+
+def _load_routing_tables():
+    db = mongo_client.get()[DB_NAME]
+    return RoutingTables(db["collection_routing"], db["purchases_routing"])
+
+# Create a shared environment across all connections (connected on first use)
+mongo_client = Lazy("mongo", _connect_mongo)
+nlp = Lazy("spacy", _load_spacy)
+# Shared by every session's Router and reloaded only when the routing data changes
+routing_tables = Lazy("routing_tables", _load_routing_tables)
+
+# Loaded with the Ollama models on startup, so the first user doesn't pay for it (see src/models/lifecycle.py)
+model_lifecycle.add_loader("sentence_transformer", lambda: embed_text("warmup"))
+model_lifecycle.add_loader("spacy", nlp.get)
+model_lifecycle.add_loader("routing_tables", routing_tables.get)
+model_lifecycle.add_loader("pre_router", pre_router.get)
 
 def create_user_session(args, user_id):
     # Retrieve tables from MongoDB
     start_time = time.time()
 
-    db = _client[DB_NAME]
+    db = mongo_client.get()[DB_NAME]
 
     product_retriever = ProductRetriever(db["products"])
     purchase_retriever = PurchaseRetriever(db["purchases"], user_id)
     faq_retriever = FAQRetriever(db["faqs"])
-    router = Router(db["collection_routing"], db["purchases_routing"])
+    router = Router(routing_tables.get())
 
     retrievers = {
         "purchases": purchase_retriever,
@@ -83,9 +111,7 @@ def user_input_filter(user_input):
 
 
 def entity_recognition_filter(user_input):
-    #python -m spacy download en_core_web_sm
-    nlp = spacy.load("en_core_web_sm")
-    inputs = nlp(user_input)
+    inputs = nlp.get()(user_input)
     for ent in inputs.ents:
         if ent.label_ in {"PERSON", "GPE", "LOC", "ORG"}:
             user_input = user_input.replace(ent.text,f"[REDACTED {ent.label_}]")
@@ -108,19 +134,72 @@ def log_sft_example(prompt, answer, route=None, path="data/rag_sft.jsonl"):
         f.write(json.dumps(example) + "\n")
 
 
-def process_message(user_id, user_input, args, conversation, filtered_convo, retrievers, router):
+def process_turn(user_id, user_input, args, conversation, filtered_convo, retrievers, router, sink=None):
+    """
+    Run one user turn through the pipeline.
+
+    Returns a dict with the final `reply`, the SLM's own answer (`slm_reply`), the
+    `confidence` verdict, whether the LLM fallback was used (`used_llm`), whether the reply
+    came from the answer cache (`cached`) and the per-stage `timings` (in seconds) recorded
+    into `src.metrics` during this turn.
+    `sink` (see src/models/sinks.py) receives the tokens of the SLM answer and, if the SLM is
+    not confident, of the LLM answer as they arrive; by default they are printed to the console.
+    """
+    with metrics.turn() as timings:
+        start_time = time.time()
+        result = _run_turn(user_id, user_input, args, conversation, filtered_convo, retrievers, router, sink)
+        metrics.observe("total", time.time() - start_time)
+
+    metrics.increment("turns")
+    if result["used_llm"]:
+        metrics.increment("llm_fallbacks")
+
+    result["timings"] = timings
+    return result
 
-    query_context = get_query_context(
+
+def _run_turn(user_id, user_input, args, conversation, filtered_convo, retrievers, router, sink):
+
+    if sink is None:
+        sink = StdoutSink()
+
+    retrieval = retrieve_query_context(
         args=args,
         user_id=user_id,
         query=user_input,
         retrievers=retrievers,
         router=router
     )
+    query_context = retrieval["context"]
     
     if (args.verbose):
         print(f"\t[DEBUG] User context:\n{query_context}")
 
+    query_embedding = retrieval["query_embedding"]
+    # Answers only depend on the question and its context when no history is kept. Pre-routed
+    # queries are not embedded, they are answered fast enough without the semantic cache.
+    use_answer_cache = getattr(args, "answer_cache", True) and MAX_SAVED_PROMPT == 0 and query_embedding is not None
+
+    # A context that includes the user's purchases (see top-2 retrieval) is only cached for that user
+    cache_route = "purchases" if "purchases" in retrieval["routes"] else retrieval["route"]
+    if use_answer_cache:
+        cached = answer_cache.lookup(cache_route, user_id, query_embedding, query_context)
+        if cached is not None:
+            if (args.verbose):
+                print("\t[DEBUG] Answer cache hit")
+
+            sink.start(source="cache")
+            sink.write(cached["reply"])
+            sink.end()
+
+            return {
+                "reply": cached["reply"],
+                "slm_reply": cached["slm_reply"],
+                "confidence": cached["confidence"],
+                "used_llm": False,
+                "cached": True,
+            }
+
     filtered_input = user_input_filter(user_input)
     filtered_input = entity_recognition_filter(filtered_input)
 
@@ -129,9 +208,8 @@ def process_message(user_id, user_input, args, conversation, filtered_convo, ret
     
     filtered_query_context = user_input_filter(query_context)
 
+    # The instructions are sent once as the system prompt (see SYSTEM_PROMPT in src/models/slm.py)
     prompt_template = (
-        "You are a customer support agent.\n"
-        "Answer briefly using ONLY the provided context.\n\n"
         "### USER CONTEXT\n"
         "{context}\n\n"
         "### QUESTION\n"
@@ -168,9 +246,22 @@ def process_message(user_id, user_input, args, conversation, filtered_convo, ret
         "content": filtered_prompt
     })
 
-    print("AI: ", end="", flush=True)
+    # If the SLM stream is aborted early, the fallback is started before its connection is closed
+    early_llm = []
+
+    def start_fallback():
+        early_llm.append(start_llm_response(args, build_messages(filtered_convo), sink=sink))
 
-    reply, confidence = stream_response(args, conversation)
+    reply, confidence = stream_response(
+        args,
+        conversation,
+        sink=sink,
+        route=getattr(router, "last_route", None),
+        context=query_context,
+        on_abort=start_fallback
+    )
+    slm_reply = reply
+    used_llm = False
 
     if not confidence:
 
@@ -178,25 +269,57 @@ def process_message(user_id, user_input, args, conversation, filtered_convo, ret
             print(f"\t[DEBUG] Filtered input: {filtered_input}")
 
         start_time = time.time()
-        reply = llm_response(args, filtered_convo)
+        try:
+            if early_llm:
+                reply = early_llm[0].result()
+            else:
+                reply = llm_response(args, build_messages(filtered_convo), sink=sink)
+            used_llm = True
+        except LLMDeadlineExceeded as e:
+            # Better a hesitant answer than none at all
+            metrics.increment("llm_deadline_exceeded")
+            if e.streamed:
+                # The client shows the partial LLM answer, put the SLM answer we keep back in its place
+                sink.start(source="slm")
+                sink.write(slm_reply)
+                sink.end()
+            if (args.verbose):
+                print("\t[DEBUG] LLM deadline exceeded, keeping the SLM answer")
         end_time = time.time()
 
         if(args.verbose):
             print("\t[DEBUG] LLM response time: ", end_time - start_time)
 
+    # A confident SLM answer means the query was routed to useful context, so the k-NN router can learn from it
+    # (not when the context came from two routes, the answer doesn't tell which one was right)
+    if confidence and getattr(router, "learn_online", False) and query_embedding is not None and len(retrieval["routes"]) == 1:
+        router.add_exemplar(retrieval["route"], query_embedding)
+
     conversation.append({"role": "assistant", "content": reply})
     filtered_convo.append({"role": "assistant", "content": reply})
 
+    # An unconfident SLM answer kept because the LLM missed its deadline (possibly cut short by an
+    # early abort) must not be served to anyone else
+    if use_answer_cache and (confidence or used_llm):
+        answer_cache.store(
+            cache_route,
+            user_id,
+            query_embedding,
+            query_context,
+            reply,
+            slm_reply=slm_reply,
+            confidence=confidence
+        )
+
     if (args.generate_data):
         if reply and len(reply.split()) <= 256:
             log_sft_example(
-                prompt=user_prompt,
+                prompt=SYSTEM_PROMPT + user_prompt,
                 answer=reply,
                 route=router.last_route if hasattr(router, "last_route") else None
             )
 
-    max_saved_prompt = 0 # currently disable any saved prompt
-    max_length = max_saved_prompt * 2 # 1 for user content & 1 for assistant content
+    max_length = MAX_SAVED_PROMPT * 2 # 1 for user content & 1 for assistant content
     if max_length == 0:
         conversation.clear()
         filtered_convo.clear()
@@ -204,11 +327,24 @@ def process_message(user_id, user_input, args, conversation, filtered_convo, ret
         del conversation[:-max_length]
         del filtered_convo[:-max_length]
 
-    return reply
+    return {
+        "reply": reply,
+        "slm_reply": slm_reply,
+        "confidence": confidence,
+        "used_llm": used_llm,
+        "cached": False,
+    }
+
+
+def process_message(user_id, user_input, args, conversation, filtered_convo, retrievers, router, sink=None):
+    result = process_turn(user_id, user_input, args, conversation, filtered_convo, retrievers, router, sink)
+    return result["reply"]
 
 
 def main_loop(args):
-    warmup_model()
+    if not model_lifecycle.preload():
+        print("Warning: not every model could be loaded, see the messages above")
+    model_lifecycle.start(preload=False)
 
     try:
         user_id = int(input("Enter user ID: ").strip())
@@ -220,6 +356,7 @@ def main_loop(args):
     
     conversation = []
     filtered_convo = []
+    sink = StdoutSink()
     # write_to_output_txt(user_data)
 
     print("Chat with Ollama (type 'exit' or 'quit' to end)")
@@ -231,7 +368,7 @@ def main_loop(args):
             print("Exiting ...")
             break
 
-        process_message(user_id, user_input, args, conversation, filtered_convo, retrievers, router)
+        process_message(user_id, user_input, args, conversation, filtered_convo, retrievers, router, sink)
 
         print() 
 
@@ -0,0 +1,129 @@
+import time
+import threading
+from collections import deque, defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+
+
+class Histogram:
+    """Keeps the last `window` observations and reports count, mean and p50/p95/p99 over them."""
+
+    def __init__(self, window=2000):
+        self._values = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        self._values.append(value)
+        self.count += 1
+        self.total += value
+
+    def summary(self):
+        if not self._values:
+            return {"count": 0}
+
+        values = np.array(self._values)
+        p50, p95, p99 = np.percentile(values, [50, 95, 99])
+        return {
+            "count": self.count,
+            "mean": float(np.mean(values)),
+            "min": float(np.min(values)),
+            "max": float(np.max(values)),
+            "p50": float(p50),
+            "p95": float(p95),
+            "p99": float(p99),
+        }
+
+
+class MetricsRegistry:
+    """
+    Process-wide registry for pipeline metrics.
+
+    - `observe(name, value)` records into a histogram (stage latencies are in seconds).
+    - `increment(name, label)` bumps a counter, optionally split by label (e.g. per route).
+    - `turn()` collects everything observed by the current thread during one user turn,
+      so callers such as `process_turn` can return per-turn timings.
+    """
+
+    def __init__(self, window=2000):
+        self._window = window
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._histograms = {}
+        self._counters = defaultdict(lambda: defaultdict(int))
+
+    def observe(self, name, value):
+        with self._lock:
+            if name not in self._histograms:
+                self._histograms[name] = Histogram(self._window)
+            self._histograms[name].observe(value)
+
+        record = getattr(self._local, "turn", None)
+        if record is not None:
+            record[name] = value
+
+    def increment(self, name, label="total", amount=1):
+        with self._lock:
+            self._counters[name][label] += amount
+
+    @contextmanager
+    def timer(self, name):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start_time)
+
+    def timed(self, name):
+        """Decorator version of `timer`."""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    @contextmanager
+    def turn(self, record=None):
+        """
+        Collect the observations of the current thread into `record` (a new dict by default).
+        Passing the record of another thread's turn (see `current_turn`) lets background work
+        report into that turn.
+        """
+        if record is None:
+            record = {}
+        previous = getattr(self._local, "turn", None)
+        self._local.turn = record
+        try:
+            yield record
+        finally:
+            self._local.turn = previous
+
+    def current_turn(self):
+        """The record of the turn running on this thread, or None."""
+        return getattr(self._local, "turn", None)
+
+    def snapshot(self):
+        with self._lock:
+            histograms = {name: h.summary() for name, h in self._histograms.items()}
+            counters = {name: dict(labels) for name, labels in self._counters.items()}
+
+        turns = counters.get("turns", {}).get("total", 0)
+        fallbacks = counters.get("llm_fallbacks", {}).get("total", 0)
+
+        return {
+            "histograms": histograms,
+            "counters": counters,
+            "fallback_rate": fallbacks / turns if turns else None,
+        }
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+
+metrics = MetricsRegistry()
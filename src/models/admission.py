@@ -0,0 +1,136 @@
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+OLLAMA_MAX_IN_FLIGHT = int(os.environ.get("OLLAMA_MAX_IN_FLIGHT", 4))  # concurrent generate calls
+OLLAMA_MAX_QUEUE = int(os.environ.get("OLLAMA_MAX_QUEUE", 16))  # calls allowed to wait for a slot
+OLLAMA_QUEUE_TIMEOUT = float(os.environ.get("OLLAMA_QUEUE_TIMEOUT", 30))  # seconds a call may wait
+
+
+class OllamaOverloadedError(Exception):
+    """Raised when a call is rejected because the Ollama wait queue is full (or the wait timed out)."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Limits how many calls run against the Ollama backend at once.
+
+    At most `max_in_flight` calls run concurrently. Further calls wait in a FIFO queue (so earlier
+    requests are served first) of at most `max_queue_depth` entries; once the queue is full new
+    calls are rejected immediately with `OllamaOverloadedError`, which carries a Retry-After hint.
+    """
+
+    def __init__(self, max_in_flight, max_queue_depth, queue_timeout, window=1000):
+        self.max_in_flight = max_in_flight
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters = deque()  # threading.Event per waiting call, in arrival order
+
+        self._wait_times = deque(maxlen=window)
+        self._service_times = deque(maxlen=window)
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.max_queue_depth_seen = 0
+
+    def _retry_after_locked(self):
+        # Rough estimate of how long it takes for the current queue to drain.
+        service_time = np.mean(self._service_times) if self._service_times else 1.0
+        waves = (len(self._waiters) + 1) / self.max_in_flight
+        return max(1, int(np.ceil(service_time * waves)))
+
+    def is_saturated(self):
+        """True if a new call would be rejected right now. Used to fail fast before doing other work."""
+        with self._lock:
+            return self._in_flight >= self.max_in_flight and len(self._waiters) >= self.max_queue_depth
+
+    def retry_after(self):
+        with self._lock:
+            return self._retry_after_locked()
+
+    def _acquire(self):
+        start_time = time.time()
+
+        with self._lock:
+            if self._in_flight < self.max_in_flight and not self._waiters:
+                self._in_flight += 1
+                self.admitted += 1
+                self._wait_times.append(0.0)
+                return
+
+            if len(self._waiters) >= self.max_queue_depth:
+                self.rejected += 1
+                raise OllamaOverloadedError(
+                    f"Ollama queue is full ({len(self._waiters)} waiting)",
+                    retry_after=self._retry_after_locked()
+                )
+
+            event = threading.Event()
+            self._waiters.append(event)
+            self.max_queue_depth_seen = max(self.max_queue_depth_seen, len(self._waiters))
+
+        granted = event.wait(self.queue_timeout)
+
+        with self._lock:
+            # The slot may have been handed over just as the wait timed out.
+            if not granted and not event.is_set():
+                self._waiters.remove(event)
+                self.timed_out += 1
+                raise OllamaOverloadedError(
+                    f"Timed out after {self.queue_timeout}s waiting for an Ollama slot",
+                    retry_after=self._retry_after_locked()
+                )
+            self.admitted += 1
+            self._wait_times.append(time.time() - start_time)
+
+    def _release(self, service_time):
+        with self._lock:
+            self._service_times.append(service_time)
+            if self._waiters:
+                # Hand the slot straight to the oldest waiter; in-flight count is unchanged.
+                self._waiters.popleft().set()
+            else:
+                self._in_flight -= 1
+
+    @contextmanager
+    def slot(self):
+        """Context manager that holds one in-flight slot for the duration of an Ollama call."""
+        self._acquire()
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self._release(time.time() - start_time)
+
+    def stats(self):
+        with self._lock:
+            wait_times = np.array(self._wait_times) if self._wait_times else np.zeros(1)
+            return {
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._waiters),
+                "max_in_flight": self.max_in_flight,
+                "max_queue_depth": self.max_queue_depth,
+                "max_queue_depth_seen": self.max_queue_depth_seen,
+                "admitted": self.admitted,
+                "rejected": self.rejected,
+                "timed_out": self.timed_out,
+                "wait_time_avg": float(np.mean(wait_times)),
+                "wait_time_p95": float(np.percentile(wait_times, 95)),
+                "wait_time_max": float(np.max(wait_times)),
+                "service_time_avg": float(np.mean(self._service_times)) if self._service_times else None,
+            }
+
+
+# Shared by every Ollama call in the process (primary stream and confidence samples).
+ollama_admission = AdmissionController(OLLAMA_MAX_IN_FLIGHT, OLLAMA_MAX_QUEUE, OLLAMA_QUEUE_TIMEOUT)
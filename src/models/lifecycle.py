@@ -0,0 +1,193 @@
+import os
+import time
+import threading
+
+import requests
+
+from src.models.ollama_client import ollama_client, OLLAMA_KEEP_ALIVE
+from src.models.slm import MODEL, OLLAMA_API, build_messages
+from src.metrics import metrics
+
+# Models that are loaded but not required, e.g. the fine-tuned build from fine_tuning/Modelfile
+# (`ollama create phi3-rag -f fine_tuning/Modelfile`). Comma-separated, empty for none.
+OLLAMA_EXTRA_MODELS = os.environ.get("OLLAMA_EXTRA_MODELS", "phi3-rag")
+MODEL_CHECK_INTERVAL = float(os.environ.get("MODEL_CHECK_INTERVAL", 60))  # seconds between residency checks
+
+
+class ModelLifecycle:
+    """
+    Keeps the Ollama models loaded on every host of `ollama_client`.
+
+    `preload()` loads every model with `keep_alive` (and the shared system prompt into its prompt
+    cache), and runs the registered loaders (embedders etc., see `add_loader`). `start()` does the
+    same in the background and then checks every `check_interval` seconds which models each host
+    still has loaded (GET /api/ps), re-warming the ones Ollama evicted after being idle or restarted,
+    and runs again the loaders that failed.
+
+    The service is ready once every required model is loaded on at least one host and every
+    loader has run. Optional models that a host does not have are reported as "missing".
+    """
+
+    def __init__(self, models, optional_models=(), check_interval=60, keep_alive="30m"):
+        self.models = list(models)
+        self.optional_models = [m for m in optional_models if m not in self.models]
+        self.check_interval = check_interval
+        self.keep_alive = keep_alive
+
+        self._loaders = {}  # name -> function loading it
+        self._loader_state = {}  # name -> "pending" / "loaded" / "failed: ..."
+        self._model_state = {}  # (host url, model) -> "pending" / "loaded" / "missing" / "failed: ..."
+        self._lock = threading.Lock()
+        self._thread = None
+        self.rewarms = 0
+
+    def add_loader(self, name, func):
+        """Register `func` to be called on preload, e.g. to load an embedding model."""
+        with self._lock:
+            self._loaders[name] = func
+            self._loader_state[name] = "pending"
+
+    def _warm(self, host, model):
+        payload = {
+            "model": model,
+            "messages": build_messages([{"role": "user", "content": "Hi"}]),
+            "stream": False,
+            "keep_alive": self.keep_alive,
+            "options": {"num_predict": 1}
+        }
+
+        try:
+            ollama_client.post(OLLAMA_API, payload, host=host)
+            state = "loaded"
+        except requests.HTTPError as e:
+            state = "missing" if e.response is not None and e.response.status_code == 404 else f"failed: {e}"
+        except requests.RequestException as e:
+            state = f"failed: {e}"
+
+        with self._lock:
+            self._model_state[(host.base_url, model)] = state
+        return state
+
+    def _run_loader(self, name, func):
+        start_time = time.time()
+        try:
+            func()
+            state = "loaded"
+        except Exception as e:
+            state = f"failed: {e}"
+        metrics.observe(f"load_{name}", time.time() - start_time)
+
+        with self._lock:
+            self._loader_state[name] = state
+
+    def preload(self):
+        """Load every model on every host and run the loaders. Blocks until done."""
+        with self._lock:
+            for host in ollama_client.hosts:
+                for model in self.models + self.optional_models:
+                    self._model_state.setdefault((host.base_url, model), "pending")
+            loaders = list(self._loaders.items())
+
+        for host in ollama_client.hosts:
+            for model in self.models + self.optional_models:
+                start_time = time.time()
+                state = self._warm(host, model)
+                if state == "loaded":
+                    metrics.observe("model_load", time.time() - start_time)
+                elif model in self.models:
+                    print(f"Could not load {model} on {host.base_url}: {state}")
+
+        for name, func in loaders:
+            self._run_loader(name, func)
+
+        return self.ready()
+
+    def loaded_models(self, host):
+        """Names of the models `host` currently has in memory, or None if it can't be reached."""
+        try:
+            response = host.session.get(host.base_url + "/api/ps", timeout=(ollama_client.connect_timeout, ollama_client.connect_timeout))
+            response.raise_for_status()
+        except requests.RequestException:
+            return None
+
+        names = set()
+        for entry in response.json().get("models", []):
+            names.add(entry.get("name"))
+            names.add(entry.get("model"))
+        return names
+
+    def check_residency(self):
+        """Re-warm the models that a host no longer has loaded."""
+        for host in ollama_client.hosts:
+            loaded = self.loaded_models(host)
+            if loaded is None:
+                with self._lock:
+                    for model in self.models + self.optional_models:
+                        self._model_state[(host.base_url, model)] = "failed: host unreachable"
+                continue
+
+            for model in self.models + self.optional_models:
+                # Ollama lists models with their tag, e.g. "phi3-rag:latest"
+                if model in loaded or f"{model}:latest" in loaded:
+                    with self._lock:
+                        self._model_state[(host.base_url, model)] = "loaded"
+                    continue
+
+                if self._warm(host, model) == "loaded":
+                    self.rewarms += 1
+                    metrics.increment("model_rewarm", model)
+
+    def retry_loaders(self):
+        """Run again the loaders that failed, e.g. the routing tables during a MongoDB outage."""
+        with self._lock:
+            failed = [(name, func) for name, func in self._loaders.items() if self._loader_state[name].startswith("failed")]
+
+        for name, func in failed:
+            metrics.increment("loader_retry", name)
+            self._run_loader(name, func)
+
+    def _run(self, preload):
+        if preload:
+            self.preload()
+        while True:
+            time.sleep(self.check_interval)
+            self.check_residency()
+            self.retry_loaders()
+
+    def start(self, preload=True):
+        """Preload in the background, then keep the models resident. Safe to call more than once."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, args=(preload,), name="model-lifecycle", daemon=True)
+            self._thread.start()
+
+    def ready(self):
+        with self._lock:
+            if any(state != "loaded" for state in self._loader_state.values()):
+                return False
+            return all(
+                any(self._model_state.get((host.base_url, model)) == "loaded" for host in ollama_client.hosts)
+                for model in self.models
+            )
+
+    def status(self):
+        ready = self.ready()
+        with self._lock:
+            models = {}
+            for (url, model), state in self._model_state.items():
+                models.setdefault(model, {})[url] = state
+            return {
+                "ready": ready,
+                "models": models,
+                "loaders": dict(self._loader_state),
+                "rewarms": self.rewarms,
+            }
+
+
+model_lifecycle = ModelLifecycle(
+    [MODEL],
+    optional_models=[m.strip() for m in OLLAMA_EXTRA_MODELS.split(",") if m.strip()],
+    check_interval=MODEL_CHECK_INTERVAL,
+    keep_alive=OLLAMA_KEEP_ALIVE
+)
@@ -1,17 +1,229 @@
-from openai import OpenAI
+import os
+import time
+import queue
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 from dotenv import load_dotenv
+from src.metrics import metrics
 
 load_dotenv(".env", override=True)
 
-def llm_response(args, conversation):
+LLM_MODEL = os.environ.get("LLM_MODEL", "gpt-4.1")
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", 30))  # seconds the whole fallback call may take
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 1))
+# Point the fallback at any OpenAI-compatible server, e.g. a local stand-in for offline tests
+LLM_BASE_URL = os.environ.get("LLM_BASE_URL")
+LLM_BACKGROUND_WORKERS = 8  # fallbacks that can be started ahead of time, see start_llm_response
+
+
+class LLMDeadlineExceeded(TimeoutError):
+    """
+    Raised when the LLM fallback does not finish within its deadline. `streamed` is True if part
+    of the answer was already written to the sink.
+    """
+
+    def __init__(self, message, streamed=False):
+        super().__init__(message)
+        self.streamed = streamed
+
+
+_client = None
+_async_client = None
+_client_lock = threading.Lock()
+
+
+def _client_kwargs(max_retries):
+    kwargs = {"max_retries": max_retries}
+    if LLM_BASE_URL:
+        kwargs["base_url"] = LLM_BASE_URL
+        # Local stand-in servers usually don't check the key
+        kwargs["api_key"] = os.environ.get("OPENAI_API_KEY", "local")
+    return kwargs
+
+
+def get_client():
+    """Process-wide OpenAI client, so the fallback reuses its HTTP connections."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # openai is slow to import, so it's only loaded for the first fallback
+                from openai import OpenAI
+                # Retries are done by `_create`, within the deadline
+                _client = OpenAI(**_client_kwargs(max_retries=0))
+    return _client
+
+
+def get_async_client():
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                from openai import AsyncOpenAI
+                # asyncio.wait_for bounds the whole call, retries included
+                _async_client = AsyncOpenAI(**_client_kwargs(max_retries=LLM_MAX_RETRIES))
+    return _async_client
+
+
+def _create(client, deadline, start_time, **kwargs):
+    """
+    `client.chat.completions.create` with at most LLM_MAX_RETRIES retries, each attempt limited
+    to what is left of `deadline` seconds since `start_time`.
+    """
+    from openai import APIConnectionError, APITimeoutError, RateLimitError, InternalServerError
+
+    for attempt in range(LLM_MAX_RETRIES + 1):
+        remaining = start_time + deadline - time.time()
+        if remaining <= 0:
+            raise LLMDeadlineExceeded(f"LLM did not answer within {deadline}s")
+        try:
+            return client.chat.completions.create(model=LLM_MODEL, timeout=remaining, **kwargs)
+        except APITimeoutError as e:
+            raise LLMDeadlineExceeded(f"LLM did not answer within {deadline}s") from e
+        except (APIConnectionError, RateLimitError, InternalServerError):
+            if attempt == LLM_MAX_RETRIES:
+                raise
+            metrics.increment("llm_retries")
+
+
+def _produce(events, stop, client, deadline, start_time, conversation, stream):
+    """
+    Runs the LLM call on a worker thread and puts its results on the `events` queue:
+    ("text", str) per streamed chunk (or the whole answer), then ("done", None) or ("error", e).
+    """
+    try:
+        response = _create(client, deadline, start_time, messages=conversation, stream=stream)
+        if not stream:
+            events.put(("text", response.choices[0].message.content))
+        else:
+            with response:
+                for chunk in response:
+                    if stop.is_set():
+                        return
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        events.put(("text", chunk.choices[0].delta.content))
+        events.put(("done", None))
+    except Exception as e:
+        events.put(("error", e))
+
+
+@metrics.timed("llm")
+def llm_response(args, conversation, sink=None, deadline=None):
+    """
+    Ask the LLM to answer `conversation`.
+
+    With a `sink` (see src/models/sinks.py), the answer is streamed into it as it arrives.
+    Raises `LLMDeadlineExceeded` if the whole call, retries included, takes longer than
+    `deadline` seconds (defaults to LLM_DEADLINE); the sink is ended first if part of the answer
+    was already written to it.
+    """
+    if deadline is None:
+        deadline = LLM_DEADLINE
+
+    client = get_client()
+    start_time = time.time()
+
+    # Socket reads only time out between two chunks, so a slowly trickling answer would run past
+    # any HTTP timeout. The call runs on a worker thread instead and this one stops waiting for
+    # it at the deadline; the worker then drops the connection when its next read returns.
+    events = queue.Queue()
+    stop = threading.Event()
+    threading.Thread(
+        target=_produce,
+        args=(events, stop, client, deadline, start_time, conversation, sink is not None),
+        name="llm-stream",
+        daemon=True
+    ).start()
+
+    reply = ""
+    try:
+        while True:
+            try:
+                kind, value = events.get(timeout=max(0.0, start_time + deadline - time.time()))
+            except queue.Empty:
+                stop.set()
+                raise LLMDeadlineExceeded(f"LLM did not finish within {deadline}s", streamed=bool(reply))
+
+            if kind == "error":
+                if isinstance(value, LLMDeadlineExceeded):
+                    value.streamed = bool(reply)
+                raise value
+            if kind == "done":
+                break
+
+            if not reply:
+                metrics.observe("llm_first_token", time.time() - start_time)
+                # Only now, a failed call must not replace the SLM answer on the client
+                if sink is not None:
+                    sink.start(source="llm")
+            if sink is not None:
+                sink.write(value)
+            reply += value
+    finally:
+        if sink is not None and reply:
+            sink.end()
+
+    if sink is None:
+        print("LLM: ", reply)
+    return reply
+
+
+_executor = None
+
+
+def start_llm_response(args, conversation, sink=None, deadline=None):
+    """
+    Start `llm_response` on a background thread and return its `Future`.
+
+    Used to get the fallback going while the SLM stream is still being shut down. Its timings
+    are recorded into the caller's current turn (see `metrics.turn`).
+    """
+    global _executor
+    if _executor is None:
+        with _client_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=LLM_BACKGROUND_WORKERS, thread_name_prefix="llm")
+
+    turn = metrics.current_turn()
+
+    def run():
+        with metrics.turn(turn):
+            return llm_response(args, conversation, sink=sink, deadline=deadline)
+
+    return _executor.submit(run)
+
+
+async def llm_response_async(args, conversation, sink=None, deadline=None):
+    """Async version of `llm_response` for servers running an event loop."""
+    if deadline is None:
+        deadline = LLM_DEADLINE
 
+    client = get_async_client()
+    start_time = time.time()
 
-    client = OpenAI()
+    async def run():
+        if sink is None:
+            response = await client.chat.completions.create(model=LLM_MODEL, messages=conversation)
+            return response.choices[0].message.content
 
-    response = client.chat.completions.create(
-        model="gpt-4.1",
-        messages=conversation
-    )
+        stream = await client.chat.completions.create(model=LLM_MODEL, messages=conversation, stream=True)
+        sink.start(source="llm")
+        started.append(True)
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                sink.write(chunk.choices[0].delta.content)
+                reply.append(chunk.choices[0].delta.content)
+        sink.end()
+        return "".join(reply)
 
-    print("LLM: ", response.choices[0].message.content)
-    return response.choices[0].message.content
+    started, reply = [], []
+    try:
+        return await asyncio.wait_for(run(), timeout=deadline)
+    except asyncio.TimeoutError as e:
+        if started:
+            sink.end()
+        raise LLMDeadlineExceeded(f"LLM did not finish within {deadline}s", streamed=bool(reply)) from e
+    finally:
+        metrics.observe("llm", time.time() - start_time)
@@ -0,0 +1,340 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from src.metrics import metrics
+
+# Comma-separated list of Ollama servers to spread the calls over (defaults to OLLAMA_HOST)
+OLLAMA_HOSTS = os.environ.get("OLLAMA_HOSTS") or os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+OLLAMA_POOL_SIZE = int(os.environ.get("OLLAMA_POOL_SIZE", 16))  # keep-alive connections kept open per host
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", 3))  # seconds
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", 120))  # seconds between bytes
+OLLAMA_MAX_RETRIES = int(os.environ.get("OLLAMA_MAX_RETRIES", 2))  # retries on connection reset
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")  # how long Ollama keeps the model loaded
+OLLAMA_HEALTH_INTERVAL = float(os.environ.get("OLLAMA_HEALTH_INTERVAL", 10))  # seconds between health checks
+OLLAMA_EJECT_AFTER = int(os.environ.get("OLLAMA_EJECT_AFTER", 3))  # consecutive failures before a host is ejected
+OLLAMA_EJECT_TIME = float(os.environ.get("OLLAMA_EJECT_TIME", 30))  # seconds an ejected host gets no calls
+OLLAMA_AFFINITY_SLACK = int(os.environ.get("OLLAMA_AFFINITY_SLACK", 1))  # extra in-flight calls accepted to keep affinity
+
+
+class OllamaHost:
+    """One Ollama server of the pool: its connection pool, load and health."""
+
+    def __init__(self, base_url, pool_size):
+        self.base_url = base_url.rstrip("/")
+
+        self.session = requests.Session()
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount("http://", self.adapter)
+        self.session.mount("https://", self.adapter)
+
+        self.in_flight = 0
+        self.healthy = True
+        self.failures = 0  # consecutive
+        self.ejected_until = 0.0
+
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+
+    def available(self, now):
+        return self.healthy and now >= self.ejected_until
+
+    def stats(self):
+        new_connections = 0
+        pool_requests = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                new_connections += pool.num_connections
+                pool_requests += pool.num_requests
+
+        return {
+            "base_url": self.base_url,
+            "healthy": self.healthy,
+            "ejected": time.time() < self.ejected_until,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "ejections": self.ejections,
+            "connections_opened": new_connections,
+            "connections_reused": max(0, pool_requests - new_connections),
+        }
+
+
+def affinity_key(payload):
+    """
+    Default affinity key of a call: its first non-system message.
+
+    Within a turn the primary answer and its confidence samples share the whole prompt, and
+    within a session (when history is kept) the conversation keeps the same first message, so
+    sending equal keys to the same host lets its prompt cache serve the shared prefix.
+    """
+    for message in payload.get("messages") or []:
+        if message.get("role") != "system":
+            return message.get("content")
+    return payload.get("prompt")
+
+
+class OllamaClient:
+    """
+    Shared HTTP client for a pool of Ollama servers.
+
+    Keeps a pool of keep-alive connections per host (one `requests.Session` each for the whole
+    process), so the primary stream and the confidence samples of a turn reuse the same TCP
+    connections. Each call goes to the least loaded available host, except that calls with the
+    same affinity key (see `affinity_key`) stick to one host as long as it is within
+    `affinity_slack` in-flight calls of the least loaded one.
+
+    Hosts are health-checked in the background every `health_interval` seconds and ejected for
+    `eject_time` seconds after `eject_after` consecutive failed calls. Calls that fail before a
+    response is received (refused / reset connections) are retried, on another host if possible.
+    """
+
+    def __init__(self, base_urls, pool_size, connect_timeout, read_timeout, max_retries,
+                 health_interval=10, eject_after=3, eject_time=30, affinity_slack=1):
+        if isinstance(base_urls, str):
+            base_urls = [url.strip() for url in base_urls.split(",") if url.strip()]
+
+        self.hosts = [OllamaHost(url, pool_size) for url in base_urls]
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.health_interval = health_interval
+        self.eject_after = eject_after
+        self.eject_time = eject_time
+        self.affinity_slack = affinity_slack
+
+        self._lock = threading.Lock()
+        self._health_thread = None
+        self.requests = 0
+        self.retries = 0
+        self.errors = 0
+
+    @property
+    def base_url(self):
+        return self.hosts[0].base_url
+
+    def _rendezvous(self, key, host):
+        return hashlib.sha1(f"{host.base_url}|{key}".encode("utf-8")).digest()
+
+    def _choose_locked(self, affinity, exclude):
+        now = time.time()
+        candidates = [h for h in self.hosts if h not in exclude and h.available(now)]
+        if not candidates:
+            # Nothing known to be up: try anything not already tried rather than failing outright
+            candidates = [h for h in self.hosts if h not in exclude] or list(self.hosts)
+
+        least_loaded = min(candidates, key=lambda h: h.in_flight)
+        if affinity is None:
+            return least_loaded
+
+        preferred = max(candidates, key=lambda h: self._rendezvous(affinity, h))
+        if preferred.in_flight <= least_loaded.in_flight + self.affinity_slack:
+            return preferred
+        return least_loaded
+
+    def _record_failure_locked(self, host):
+        host.errors += 1
+        host.failures += 1
+        if host.failures >= self.eject_after and time.time() >= host.ejected_until:
+            host.ejected_until = time.time() + self.eject_time
+            host.ejections += 1
+            metrics.increment("ollama_host_ejected", host.base_url)
+
+    def post(self, path, payload, stream=False, timeout=None, affinity=None, host=None):
+        """
+        POST `payload` to `path` (e.g. "/api/chat") on one of the hosts and return the
+        `requests.Response`.
+
+        `timeout` overrides the read timeout for this call. `affinity` overrides the default
+        affinity key derived from the payload and `host` (an `OllamaHost`) pins the call to one
+        host. With `stream=True` the caller should use the response as a context manager so the
+        connection goes back to the pool.
+        """
+        self._start_health_checks()
+
+        timeout = (self.connect_timeout, timeout if timeout is not None else self.read_timeout)
+        if affinity is None:
+            affinity = affinity_key(payload)
+
+        with self._lock:
+            self.requests += 1
+
+        tried = set()
+        for attempt in range(self.max_retries + 1):
+            with self._lock:
+                target = host if host is not None else self._choose_locked(affinity, tried)
+                target.in_flight += 1
+                target.requests += 1
+            tried.add(target)
+
+            try:
+                response = target.session.post(target.base_url + path, json=payload, stream=stream, timeout=timeout)
+                response.raise_for_status()
+            except requests.ConnectionError:
+                # Stale keep-alive connections can be reset by the server; retry on a fresh one.
+                with self._lock:
+                    target.in_flight -= 1
+                    self._record_failure_locked(target)
+                    if attempt == self.max_retries:
+                        self.errors += 1
+                    else:
+                        self.retries += 1
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(0.05 * (attempt + 1))
+                continue
+            except requests.RequestException as e:
+                with self._lock:
+                    target.in_flight -= 1
+                    self.errors += 1
+                    # A 5xx says the server is in trouble, a 4xx says the request is
+                    status = getattr(e.response, "status_code", 500)
+                    if status >= 500:
+                        self._record_failure_locked(target)
+                raise
+
+            with self._lock:
+                target.failures = 0
+
+            self._track_in_flight(target, response, stream)
+            return response
+
+    def _track_in_flight(self, host, response, stream):
+        """The call counts as in flight until its body is read (or the streamed response is closed)."""
+        if not stream:
+            with self._lock:
+                host.in_flight -= 1
+            return
+
+        close = response.close
+        released = []
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                with self._lock:
+                    if not released:
+                        released.append(True)
+                        host.in_flight -= 1
+
+        response.close = close_and_release
+
+    def _start_health_checks(self):
+        if self._health_thread is not None or self.health_interval <= 0:
+            return
+        with self._lock:
+            if self._health_thread is None:
+                self._health_thread = threading.Thread(target=self._health_loop, name="ollama-health", daemon=True)
+                self._health_thread.start()
+
+    def check_health(self):
+        """Ping every host once (GET /api/tags) and update its health."""
+        for host in self.hosts:
+            try:
+                host.session.get(host.base_url + "/api/tags", timeout=(self.connect_timeout, self.connect_timeout)).raise_for_status()
+                healthy = True
+            except requests.RequestException:
+                healthy = False
+
+            with self._lock:
+                if healthy and not host.healthy:
+                    # Back up: give it calls again without waiting out the ejection
+                    host.failures = 0
+                    host.ejected_until = 0.0
+                    metrics.increment("ollama_host_recovered", host.base_url)
+                host.healthy = healthy
+
+    def _health_loop(self):
+        while True:
+            time.sleep(self.health_interval)
+            self.check_health()
+
+    def stats(self):
+        hosts = []
+        with self._lock:
+            for host in self.hosts:
+                hosts.append(host.stats())
+
+            return {
+                "requests": self.requests,
+                "retries": self.retries,
+                "errors": self.errors,
+                "connections_opened": sum(h["connections_opened"] for h in hosts),
+                "connections_reused": sum(h["connections_reused"] for h in hosts),
+                "hosts": hosts,
+            }
+
+
+ollama_client = OllamaClient(
+    OLLAMA_HOSTS, OLLAMA_POOL_SIZE, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT, OLLAMA_MAX_RETRIES,
+    health_interval=OLLAMA_HEALTH_INTERVAL,
+    eject_after=OLLAMA_EJECT_AFTER,
+    eject_time=OLLAMA_EJECT_TIME,
+    affinity_slack=OLLAMA_AFFINITY_SLACK
+)
+
+
+class PrefixCacheStats:
+    """
+    Estimates how much of each prompt Ollama served from its prompt (KV) cache.
+
+    Ollama's `prompt_eval_count` only counts the prompt tokens it had to evaluate, so for a given
+    prompt the largest count seen so far is taken as its full length and anything below that as
+    cached. This is a lower bound: a prompt whose first call already hit the cache (e.g. only the
+    shared system prefix) is never seen fully evaluated.
+    """
+
+    def __init__(self, max_prompts=1000):
+        self._max_prompts = max_prompts
+        self._full_tokens = OrderedDict()  # prompt hash -> largest prompt_eval_count seen
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hits = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    def record(self, kind, messages, data):
+        """Record the final response `data` of a chat call for `messages` (`kind` is e.g. "slm" or "sample")."""
+        evaluated = data.get("prompt_eval_count")
+        if evaluated is None:
+            return
+
+        key = hashlib.sha1(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+
+        with self._lock:
+            full = max(self._full_tokens.pop(key, 0), evaluated)
+            self._full_tokens[key] = full
+            if len(self._full_tokens) > self._max_prompts:
+                self._full_tokens.popitem(last=False)
+
+            cached = full - evaluated
+            self.calls += 1
+            self.hits += cached > 0
+            self.prompt_tokens += full
+            self.cached_tokens += cached
+
+        metrics.observe(f"{kind}_prompt_eval_tokens", evaluated)
+        metrics.observe(f"{kind}_prompt_eval_time", data.get("prompt_eval_duration", 0) / 1e9)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "hit_rate": self.hits / self.calls if self.calls else None,
+                "prompt_tokens": self.prompt_tokens,
+                "cached_tokens": self.cached_tokens,
+                "cached_token_rate": self.cached_tokens / self.prompt_tokens if self.prompt_tokens else None,
+            }
+
+
+prefix_cache_stats = PrefixCacheStats()
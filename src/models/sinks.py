@@ -0,0 +1,131 @@
+import sys
+import json
+import time
+
+
+class OutputSink:
+    """
+    Destination for the tokens of a streamed answer.
+
+    `start(source)` is called before the first token of an answer, `write(text)` once per
+    chunk received from the model and `end()` when the answer is complete. `source` is "slm",
+    "llm" or "cache". An "llm" answer replaces the SLM answer written before it.
+    """
+
+    def start(self, source="slm"):
+        pass
+
+    def write(self, text):
+        raise NotImplementedError
+
+    def end(self):
+        pass
+
+
+class NullSink(OutputSink):
+    """Discards all tokens. Used where nobody reads the stream (e.g. the blocking /api/chat)."""
+
+    def write(self, text):
+        pass
+
+
+class MemorySink(OutputSink):
+    """Collects the chunks in memory."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, text):
+        self.chunks.append(text)
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+
+class StdoutSink(OutputSink):
+    """
+    Prints the answer to the console for the CLI.
+
+    Each chunk is written in one call and the stream is flushed at most every `flush_interval`
+    seconds (and at the end of the answer). `char_delay` > 0 restores the old per-character
+    typing effect.
+    """
+
+    PREFIXES = {"slm": "AI: ", "llm": "LLM: ", "cache": "AI: "}
+
+    def __init__(self, flush_interval=0.05, char_delay=0, stream=None):
+        self.flush_interval = flush_interval
+        self.char_delay = char_delay
+        self._stream = stream
+        self._last_flush = 0.0
+
+    @property
+    def stream(self):
+        # Resolved lazily so redirect_stdout (used by the batch eval scripts) is respected.
+        return self._stream if self._stream is not None else sys.stdout
+
+    def start(self, source="slm"):
+        self.stream.write(self.PREFIXES.get(source, "AI: "))
+        self.stream.flush()
+        self._last_flush = time.time()
+
+    def write(self, text):
+        if self.char_delay > 0:
+            for char in text:
+                self.stream.write(char)
+                self.stream.flush()
+                time.sleep(self.char_delay)
+            return
+
+        self.stream.write(text)
+        now = time.time()
+        if now - self._last_flush >= self.flush_interval:
+            self.stream.flush()
+            self._last_flush = now
+
+    def end(self):
+        self.stream.write("\n")
+        self.stream.flush()
+
+
+class CallbackSink(OutputSink):
+    """Calls `callback(text)` for every chunk."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def write(self, text):
+        self.callback(text)
+
+
+class SSESink(OutputSink):
+    """
+    Puts `("start", {"source": source})` and `("token", {"token": text})` events on a queue,
+    to be sent as server-sent events by the API server (see /api/chat/stream in api_server.py).
+    """
+
+    def __init__(self, events):
+        self.events = events
+
+    def start(self, source="slm"):
+        self.events.put(("start", {"source": source}))
+
+    def write(self, text):
+        self.events.put(("token", {"token": text}))
+
+
+class WebSocketSink(OutputSink):
+    """Sends every chunk as a JSON `token` message on a websocket-like object with a `send(str)` method."""
+
+    def __init__(self, ws):
+        self.ws = ws
+
+    def start(self, source="slm"):
+        self.ws.send(json.dumps({"event": "start", "source": source}))
+
+    def write(self, text):
+        self.ws.send(json.dumps({"event": "token", "token": text}))
+
+    def end(self):
+        self.ws.send(json.dumps({"event": "end"}))
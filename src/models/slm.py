@@ -1,94 +1,174 @@
-import requests
-import ollama
 import time
 import json
 
 # from confidence import evaluate_confidence
-from src.confidence_rouge import evaluate_rouge_confidence
-
-OLLAMA_API = "http://localhost:11434/api/generate" # ollama API endpoint
+from src.confidence_rouge import (
+    evaluate_confidence,
+    start_sampling,
+    summarize_logprobs,
+    uses_verbalized_check,
+    VerbalizedConfidenceMonitor,
+)
+from src.models.admission import ollama_admission
+from src.models.ollama_client import ollama_client, prefix_cache_stats, OLLAMA_KEEP_ALIVE
+from src.models.sinks import StdoutSink
+from src.metrics import metrics
+
+OLLAMA_API = "/api/chat" # ollama API endpoint, see src/models/ollama_client.py for the host
 MODEL = "phi3:3.8b"
+
+# Kept identical across calls (and first in every message list) so Ollama can reuse its
+# prompt cache for it on the primary call and on every confidence sample.
+SYSTEM_PROMPT = (
+    "You are a customer support agent.\n"
+    "Answer briefly using ONLY the provided context.\n\n"
+)
+NUM_CONFIDENCE_SAMPLES = 2  # additional responses generated for the ROUGE comparison
+TOP_LOGPROBS = 5  # alternatives returned per token, used for the entropy of the logprob confidence
 CHAR_DELAY = 0  # delay between characters for printing out AI response
 
-def warmup_model():
-    """Dummy request to load the model into memory"""
-    payload = {
-        "model": MODEL,
-        "prompt": "Hi",
-        "stream": False,
-        "options": {"num_predict": 1}
-    }
-    requests.post(OLLAMA_API, json=payload)
+def build_messages(messages):
+    """Prepend the shared system prompt to a conversation."""
+    return [{"role": "system", "content": SYSTEM_PROMPT}] + messages
 
-def stream_response(args, messages):
+def stream_response(args, messages, sink=None, route=None, context=None, on_abort=None):
+    """
+    Stream the SLM answer for `messages`, then score its confidence.
 
-    start_time = time.time()
-    prompt = ""
-    for msg in messages:
-        role = "You" if msg["role"] == "user" else "AI"
-        prompt += f"{role}: {msg['content']}\n"
-    
-    prompt += "AI: "
+    Every chunk of text is written to `sink` (see src/models/sinks.py) as soon as Ollama
+    returns it. Defaults to printing to the console.
+
+    With `args.overlap_confidence`, the confidence samples are requested at the same time
+    as the primary stream instead of after it (needs an Ollama with OLLAMA_NUM_PARALLEL > 1).
+    `route` and the retrieved `context` select and feed the confidence strategy cascade,
+    see `evaluate_confidence`. With `args.logprob_confidence`, the token logprobs of this
+    generation replace the ROUGE resampling.
+
+    Unless `args.early_abort` is False, the answer is checked for verbalized non-confidence
+    ("sorry", "as an ...") while it streams. On a match the stream is closed right away, the
+    rest of the confidence evaluation is skipped and the answer is returned as not confident.
+    `on_abort` is then called before the connection is closed, e.g. to start the LLM fallback.
+    """
+
+    chat_messages = build_messages(messages)
 
     payload = {
         "model": MODEL,
-        "prompt": prompt,
+        "messages": chat_messages,
         "stream": True, # This allows us to access AI's response before it's done
+        "keep_alive": OLLAMA_KEEP_ALIVE,  # keep the model (and its prompt cache) loaded between turns
+        "logprobs": True,  # per-token logprobs for the logprob confidence strategy
+        "top_logprobs": TOP_LOGPROBS,
         "options": {
             "num_predict": 100,  # Maximum number of tokens for the AI response length
-            "stop": ["\n\n", "You:"],
+            "stop": ["\n\n"],
             "top_k": 1
         }
     }
 
+    # The prompt is fully known here, so in overlapped mode the samples can start right away.
+    samples = None
+    if getattr(args, "overlap_confidence", False):
+        samples = start_sampling(MODEL, chat_messages, NUM_CONFIDENCE_SAMPLES)
+
+    if sink is None:
+        sink = StdoutSink(char_delay=CHAR_DELAY)
+
+    logprob_only = getattr(args, "logprob_confidence", False)
+    monitor = None
+    if getattr(args, "early_abort", True) and uses_verbalized_check(route, logprob_only=logprob_only):
+        monitor = VerbalizedConfidenceMonitor()
+    aborted = False
+
     response_text = ""
+    token_logprobs = []
     start_time = time.time()
-
-    # This prints out the AI's response as it's responding
-    # (as opposed to printing once the AI is done responding).
-    with requests.post(OLLAMA_API, json=payload, stream=True) as r:
-        for line in r.iter_lines():
-            if not line:
-                continue
+    sink.start()
+
+    # This writes out the AI's response to the sink as it's responding
+    # (as opposed to once the AI is done responding).
+    # The admission slot is held for the whole stream, see src/models/admission.py.
+    try:
+        with ollama_admission.slot(), ollama_client.post(OLLAMA_API, payload, stream=True) as r:
+            for line in r.iter_lines():
+                if not line:
+                    continue
             
-            try:
-                data = json.loads(line.decode("utf-8"))
+                try:
+                    data = json.loads(line.decode("utf-8"))
                 
-                if "response" in data:
-                    chunk = data["response"]
-                    
-                    for char in chunk:
-                        print(char, end="", flush=True)
-                        time.sleep(CHAR_DELAY)
-                    
-                    response_text += chunk
+                    if "message" in data:
+                        chunk = data["message"].get("content", "")
+
+                        if chunk:
+                            if not response_text:
+                                metrics.observe("slm_first_token", time.time() - start_time)
+                            sink.write(chunk)
+
+                        response_text += chunk
+
+                        if chunk and monitor is not None and not monitor.feed(chunk):
+                            # The answer already fails the verbalized check, the rest of it is not needed
+                            aborted = True
+                            sink.end()
+                            if on_abort is not None:
+                                on_abort()
+                            break
+
+                    token_logprobs.extend(data.get("logprobs") or [])
                 
-                if data.get("done", False):
-                    break
+                    if data.get("done", False):
+                        prefix_cache_stats.record("slm", chat_messages, data)
+                        break
                     
-            except json.JSONDecodeError:
-                continue
+                except json.JSONDecodeError:
+                    continue
+    except BaseException:
+        # Overlapped samples would otherwise keep their admission slots, e.g. while Ollama is overloaded
+        if samples is not None:
+            samples.cancel()
+        raise
 
-
-    print()
+    if not aborted:
+        sink.end()
 
     end_time = time.time()
+    metrics.observe("slm", end_time - start_time)
 
     if(args.verbose):
         print("\t[DEBUG] SLM response time: ", end_time - start_time)
 
+    if aborted:
+        if samples is not None:
+            samples.cancel()
+
+        metrics.increment("slm_early_abort", route or "none")
+        metrics.increment("confidence", "failed_verbalized")
+        metrics.increment("confidence_decided_by", "verbalized")
+
+        if(args.verbose):
+            print("\t[DEBUG] SLM stream aborted after failing the verbalized confidence check")
+
+        print("*** SLM is not confident ***")
+        return response_text, False
+
 
     start_time = time.time()
     
     # confidence = evaluate_confidence(prompt, response_text)
 
-    confidence = evaluate_rouge_confidence(
+    confidence = evaluate_confidence(
         model=MODEL,
-        prompt=prompt,
+        messages=chat_messages,
         original_response=response_text,
-        num_samples=2,  # generate 2 additional responses for comparison
+        num_samples=NUM_CONFIDENCE_SAMPLES,
         rouge_threshold=0.25,  # confidence threshold (adjustable)
-        verbose=args.verbose
+        verbose=args.verbose,
+        samples=samples,
+        route=route,
+        context=context,
+        logprobs=summarize_logprobs(token_logprobs),
+        logprob_only=logprob_only
     )
     
     if not confidence:
@@ -0,0 +1,213 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def estimate_size(obj, _seen=None):
+    """
+    Rough deep size (in bytes) of a session object.
+
+    Walks containers, numpy arrays and instances of our own `src.*` classes (retrievers, router),
+    but stops at objects shared by all sessions: third-party ones such as pymongo collections, and
+    process-wide ones whose class sets `shared_across_sessions = True` (e.g. RoutingTables).
+    """
+    if _seen is None:
+        _seen = set()
+
+    if id(obj) in _seen or getattr(type(obj), "shared_across_sessions", False):
+        return 0
+    _seen.add(id(obj))
+
+    if isinstance(obj, np.ndarray):
+        return sys.getsizeof(obj) + (0 if obj.base is not None else obj.nbytes)
+
+    size = sys.getsizeof(obj)
+
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += estimate_size(key, _seen) + estimate_size(value, _seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += estimate_size(item, _seen)
+    elif type(obj).__module__.startswith("src.") and hasattr(obj, "__dict__"):
+        size += estimate_size(vars(obj), _seen)
+
+    return size
+
+
+class SessionStore:
+    """
+    Bounded store of per-user sessions.
+
+    Sessions are kept in least-recently-used order and evicted when:
+      - they have been idle for longer than `idle_ttl` seconds,
+      - there are more than `max_entries` sessions, or
+      - the estimated memory of all sessions exceeds `max_memory_bytes`.
+
+    `factory(user_id)` builds a new session dict. It is used by `create` and to lazily
+    re-create a session when an evicted user comes back through `get`.
+    """
+
+    def __init__(self, factory, max_entries=100, idle_ttl=30 * 60, max_memory_bytes=None, on_evict=None):
+        self._factory = factory
+        self._max_entries = max_entries
+        self._idle_ttl = idle_ttl
+        self._max_memory_bytes = max_memory_bytes
+        self._on_evict = on_evict
+
+        self._sessions = OrderedDict()  # user_id -> {"session", "size", "created_at", "last_used"}
+        self._lock = threading.Lock()
+
+        self.created = 0
+        self.recreated = 0
+        self.evicted = 0
+
+    def _build(self, user_id):
+        session = self._factory(user_id)
+        now = time.time()
+        return {
+            "session": session,
+            "size": estimate_size(session),
+            "created_at": now,
+            "last_used": now,
+        }
+
+    def _insert(self, user_id, entry):
+        # Must be called with the lock held. Returns the entries evicted to make room.
+        replaced = self._sessions.pop(user_id, None)
+        self._sessions[user_id] = entry
+        evicted = [replaced["session"]] if replaced is not None else []
+        return evicted + self._evict_locked()
+
+    def _evict_locked(self):
+        evicted = []
+        now = time.time()
+
+        for user_id in list(self._sessions.keys()):
+            if now - self._sessions[user_id]["last_used"] > self._idle_ttl:
+                evicted.append(self._sessions.pop(user_id)["session"])
+
+        while len(self._sessions) > self._max_entries:
+            _, entry = self._sessions.popitem(last=False)
+            evicted.append(entry["session"])
+
+        if self._max_memory_bytes is not None:
+            # Always keep the most recently used session, even if it alone is over budget
+            while len(self._sessions) > 1 and self._total_size_locked() > self._max_memory_bytes:
+                _, entry = self._sessions.popitem(last=False)
+                evicted.append(entry["session"])
+
+        self.evicted += len(evicted)
+        return evicted
+
+    def _total_size_locked(self):
+        return sum(entry["size"] for entry in self._sessions.values())
+
+    def _close(self, sessions):
+        if self._on_evict is None:
+            return
+        for session in sessions:
+            try:
+                self._on_evict(session)
+            except Exception as e:
+                print(f"Error closing session resources: {e}")
+
+    def create(self, user_id):
+        """Build a fresh session for `user_id`, replacing any existing one."""
+        # Building a session hits MongoDB, so do it outside the lock.
+        entry = self._build(user_id)
+
+        with self._lock:
+            evicted = self._insert(user_id, entry)
+            self.created += 1
+
+        self._close(evicted)
+        return entry["session"]
+
+    def get(self, user_id, create=True):
+        """
+        Return the session for `user_id` and mark it as recently used.
+
+        If the session was evicted (or never existed) and `create` is True, it is rebuilt
+        with the factory. Otherwise None is returned.
+        """
+        with self._lock:
+            evicted = self._evict_locked()
+            entry = self._sessions.get(user_id)
+            if entry is not None:
+                entry["last_used"] = time.time()
+                self._sessions.move_to_end(user_id)
+
+        self._close(evicted)
+
+        if entry is not None:
+            return entry["session"]
+
+        if not create:
+            return None
+
+        entry = self._build(user_id)
+
+        with self._lock:
+            existing = self._sessions.get(user_id)
+            if existing is not None:
+                # Another request re-created it while we were building ours.
+                existing["last_used"] = time.time()
+                self._sessions.move_to_end(user_id)
+                evicted = [entry["session"]]
+                session = existing["session"]
+            else:
+                evicted = self._insert(user_id, entry)
+                self.recreated += 1
+                session = entry["session"]
+
+        self._close(evicted)
+        return session
+
+    def remove(self, user_id):
+        with self._lock:
+            entry = self._sessions.pop(user_id, None)
+
+        if entry is None:
+            return False
+
+        self._close([entry["session"]])
+        return True
+
+    def keys(self):
+        with self._lock:
+            return list(self._sessions.keys())
+
+    def __contains__(self, user_id):
+        with self._lock:
+            return user_id in self._sessions
+
+    def __len__(self):
+        with self._lock:
+            return len(self._sessions)
+
+    def stats(self):
+        with self._lock:
+            now = time.time()
+            per_session = {
+                str(user_id): {
+                    "memory_bytes": entry["size"],
+                    "idle_seconds": round(now - entry["last_used"], 1),
+                    "age_seconds": round(now - entry["created_at"], 1),
+                }
+                for user_id, entry in self._sessions.items()
+            }
+            return {
+                "count": len(self._sessions),
+                "memory_bytes": self._total_size_locked(),
+                "max_entries": self._max_entries,
+                "max_memory_bytes": self._max_memory_bytes,
+                "idle_ttl_seconds": self._idle_ttl,
+                "created": self.created,
+                "recreated": self.recreated,
+                "evicted": self.evicted,
+                "sessions": per_session,
+            }
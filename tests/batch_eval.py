@@ -13,7 +13,7 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-from src.main import create_user_session, process_message
+from src.main import create_user_session, process_turn
 
 
 def load_questions(path: str):
@@ -40,8 +40,8 @@ def find_first(pattern: str, text: str, cast=float, default=None):
 
 
 def run_batch(questions_path: str, user_id: int, output_path: str):
-    # Mimic `--verbose` and `--generate_data` flags
-    args = SimpleNamespace(verbose=True, generate_data=False)
+    # Mimic `--verbose` and `--generate_data` flags, and skip the answer cache so every question runs the full pipeline
+    args = SimpleNamespace(verbose=True, generate_data=False, answer_cache=False)
 
     # Create Mongo-backed session once (same as in `main_loop`)
     retrievers, router = create_user_session(args, user_id)
@@ -62,7 +62,7 @@ def run_batch(questions_path: str, user_id: int, output_path: str):
         buf = io.StringIO()
         start_total = time.time()
         with redirect_stdout(buf):
-            reply = process_message(
+            result = process_turn(
                 user_id=user_id,
                 user_input=question,
                 args=args,
@@ -73,6 +73,8 @@ def run_batch(questions_path: str, user_id: int, output_path: str):
             )
         total_time = time.time() - start_total
         log = buf.getvalue()
+        reply = result["reply"]
+        timings = result["timings"]
 
         # Parse metrics from the captured log
         slm_conf_raw = find_first(
@@ -81,24 +83,13 @@ def run_batch(questions_path: str, user_id: int, output_path: str):
         slm_conf_parsed = find_first(
             r"Parsed confidence score:\s*([0-9.\-eE]+)", log, cast=float, default=1.0
         )
-        rouge_confidence = find_first(
-            r"Rouge Confidence Score:\s*([0-9.\-eE]+)", log, cast=float, default=None
-        )
-        slm_response_time = find_first(
-            r"SLM response time:\s*([0-9.\-eE]+)", log, cast=float, default=None
-        )
-        conf_eval_time = find_first(
-            r"Confidence evaluation time:\s*([0-9.\-eE]+)", log, cast=float, default=None
-        )
-        llm_response_time = find_first(
-            r"LLM response time:\s*([0-9.\-eE]+)", log, cast=float, default=None
-        )
-        routing_time = find_first(
-            r"Routing Time:\s*([0-9.\-eE]+)", log, cast=float, default=None
-        )
-        context_time = find_first(
-            r"Context Retrieval Time:\s*([0-9.\-eE]+)", log, cast=float, default=None
-        )
+        # Stage timings and scores recorded by src.metrics during this turn
+        rouge_confidence = timings.get("rouge_score")
+        slm_response_time = timings.get("slm")
+        conf_eval_time = timings.get("confidence")
+        llm_response_time = timings.get("llm")
+        routing_time = timings.get("routing")
+        context_time = timings.get("context_retrieval")
 
         # Threshold checks (0.25)
         threshold = 0.25
@@ -109,8 +100,7 @@ def run_batch(questions_path: str, user_id: int, output_path: str):
             rouge_confidence is not None and rouge_confidence > threshold
         )
 
-        # Heuristic: did we fall back to the LLM?
-        used_llm = llm_response_time is not None
+        used_llm = result["used_llm"]
 
         results.append(
             {
@@ -31,7 +31,7 @@ PROJECT_ROOT = Path(__file__).resolve().parents[1]
 if str(PROJECT_ROOT) not in sys.path:
     sys.path.insert(0, str(PROJECT_ROOT))
 
-from src.main import create_user_session, process_message
+from src.main import create_user_session, process_turn
 from src.context_augmentation.context import embed_text
 from sklearn.metrics.pairwise import cosine_similarity
 
@@ -206,7 +206,7 @@ def run_batch_with_qa(
     output_path: str,
     cosine_threshold: float = 0.75,
 ):
-    args = SimpleNamespace(verbose=True, generate_data=False)
+    args = SimpleNamespace(verbose=True, generate_data=False, answer_cache=False)
     retrievers, router = create_user_session(args, user_id)
 
     questions = load_questions(questions_path)
@@ -235,7 +235,7 @@ def run_batch_with_qa(
         buf = io.StringIO()
         start_total = time.time()
         with redirect_stdout(buf):
-            reply = process_message(
+            result = process_turn(
                 user_id=user_id,
                 user_input=question,
                 args=args,
@@ -246,6 +246,8 @@ def run_batch_with_qa(
             )
         total_time = time.time() - start_total
         log = buf.getvalue()
+        reply = result["reply"]
+        timings = result["timings"]
 
         # Reference answer and required spans (from question_answers_req_span file)
         if isinstance(qa_data, dict):
@@ -272,24 +274,13 @@ def run_batch_with_qa(
         slm_conf_parsed = find_first(
             r"Parsed confidence score:\s*([0-9.\-eE]+)", log, cast=float, default=1.0
         )
-        rouge_confidence = find_first(
-            r"Rouge Confidence Score:\s*([0-9.\-eE]+)", log, cast=float, default=None
-        )
-        slm_response_time = find_first(
-            r"SLM response time:\s*([0-9.\-eE]+)", log, cast=float, default=None
-        )
-        conf_eval_time = find_first(
-            r"Confidence evaluation time:\s*([0-9.\-eE]+)", log, cast=float, default=None
-        )
-        llm_response_time = find_first(
-            r"LLM response time:\s*([0-9.\-eE]+)", log, cast=float, default=None
-        )
-        routing_time = find_first(
-            r"Routing Time:\s*([0-9.\-eE]+)", log, cast=float, default=None
-        )
-        context_time = find_first(
-            r"Context Retrieval Time:\s*([0-9.\-eE]+)", log, cast=float, default=None
-        )
+        # Stage timings and scores recorded by src.metrics during this turn
+        rouge_confidence = timings.get("rouge_score")
+        slm_response_time = timings.get("slm")
+        conf_eval_time = timings.get("confidence")
+        llm_response_time = timings.get("llm")
+        routing_time = timings.get("routing")
+        context_time = timings.get("context_retrieval")
 
         threshold = 0.25
         slm_conf_above_threshold = (
@@ -298,7 +289,7 @@ def run_batch_with_qa(
         rouge_conf_above_threshold = (
             rouge_confidence is not None and rouge_confidence > threshold
         )
-        used_llm = llm_response_time is not None
+        used_llm = result["used_llm"]
 
         results.append(
             {
@@ -0,0 +1,140 @@
+"""
+Parity check and throughput benchmark for the embedding backends (EMBEDDING_BACKEND in
+src/context_augmentation/context.py).
+
+Parity: every routing example and test query (mongodb/routing_examples.py) is embedded with
+the reference backend (torch) and with each candidate. The script reports the cosine between
+the two embeddings of each text, and whether routing still picks the same route. Routing here
+means the query embedding from the candidate against route embeddings built with the reference
+backend, as they are stored in MongoDB.
+
+Throughput: texts per second at batch sizes 1 and 128.
+
+    pip install "sentence-transformers[onnx]"
+    python tests/benchmark_embedding_backends.py --backends torch onnx onnx-int8
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# Ensure the project root is on sys.path so `src` imports work
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.context_augmentation.context import load_embedding_model
+from mongodb.routing_examples import COLLECTION_ROUTING_EXAMPLES, PURCHASES_ROUTING_EXAMPLES, TEST_QUERIES
+
+REFERENCE_BACKEND = "torch"
+
+
+def encode(model, texts, batch_size=128):
+    return model.encode(texts, batch_size=batch_size, normalize_embeddings=True, convert_to_numpy=True).astype("float32")
+
+
+def route_embeddings(model, routing_data):
+    """Averaged example embeddings per route, the way the generate_*_routing_embeddings scripts build them."""
+    return {route: np.mean(encode(model, examples), axis=0) for route, examples in routing_data.items()}
+
+
+def route(embeddings, routes):
+    names = list(routes)
+    matrix = np.stack([routes[name] for name in names])
+    matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+    return [names[i] for i in np.argmax(embeddings @ matrix.T, axis=1)]
+
+
+def parity(reference, candidate):
+    """Cosine agreement and routing decisions of `candidate` against `reference`."""
+    results = {}
+    cosines = []
+    changed = []
+
+    test_queries = [q for queries in TEST_QUERIES.values() for q in queries]
+    tables = {
+        "collection": (COLLECTION_ROUTING_EXAMPLES, test_queries),
+        "purchases": (PURCHASES_ROUTING_EXAMPLES, []),
+    }
+
+    for table, (routing_data, extra_queries) in tables.items():
+        routes = route_embeddings(reference, routing_data)
+        texts = [example for examples in routing_data.values() for example in examples] + extra_queries
+
+        ref = encode(reference, texts)
+        cand = encode(candidate, texts)
+        cosines.extend(np.sum(ref * cand, axis=1))
+
+        ref_routes = route(ref, routes)
+        cand_routes = route(cand, routes)
+        for text, a, b in zip(texts, ref_routes, cand_routes):
+            if a != b:
+                changed.append((table, text, a, b))
+        results[table] = len(texts)
+
+    cosines = np.array(cosines)
+    return {
+        "texts": sum(results.values()),
+        "cosine_mean": float(cosines.mean()),
+        "cosine_min": float(cosines.min()),
+        "changed_routes": changed,
+    }
+
+
+def throughput(model, batch_size, seconds=3.0):
+    examples = [e for examples in COLLECTION_ROUTING_EXAMPLES.values() for e in examples]
+    batch = (examples * (batch_size // len(examples) + 1))[:batch_size]
+
+    encode(model, batch, batch_size)  # warm up
+    count = 0
+    start_time = time.perf_counter()
+    while time.perf_counter() - start_time < seconds:
+        encode(model, batch, batch_size)
+        count += len(batch)
+    return count / (time.perf_counter() - start_time)
+
+
+def run_benchmark(backends, batch_sizes):
+    models = {}
+    for backend in [REFERENCE_BACKEND] + [b for b in backends if b != REFERENCE_BACKEND]:
+        try:
+            start_time = time.perf_counter()
+            models[backend] = load_embedding_model(backend)
+            print(f"Loaded {backend} in {time.perf_counter() - start_time:.1f}s")
+        except Exception as e:
+            print(f"Could not load {backend}: {e}")
+
+    if REFERENCE_BACKEND not in models:
+        return
+
+    print("\nParity against torch:")
+    for backend, model in models.items():
+        if backend == REFERENCE_BACKEND:
+            continue
+        result = parity(models[REFERENCE_BACKEND], model)
+        print(
+            f"  {backend:<10} cosine mean {result['cosine_mean']:.4f}, min {result['cosine_min']:.4f}, "
+            f"{len(result['changed_routes'])}/{result['texts']} routing decisions changed"
+        )
+        for table, text, a, b in result["changed_routes"]:
+            print(f"    [{table}] {text!r}: {a} -> {b}")
+
+    print("\nThroughput (texts/s):")
+    print("  " + f"{'backend':<10}" + "".join(f"{f'batch {b}':>12}" for b in batch_sizes))
+    for backend, model in models.items():
+        if backend not in backends:
+            continue
+        row = "".join(f"{throughput(model, b):12.1f}" for b in batch_sizes)
+        print(f"  {backend:<10}{row}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx-int8"])
+    parser.add_argument("--batch_sizes", type=int, nargs="+", default=[1, 128])
+    args = parser.parse_args()
+
+    run_benchmark(args.backends, args.batch_sizes)
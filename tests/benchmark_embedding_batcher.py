@@ -0,0 +1,85 @@
+"""
+Throughput and latency of embedding with and without micro-batching (src/embedding_batcher.py).
+
+`--concurrency` threads each embed distinct texts back to back for `--seconds`, the way
+concurrent /api/chat requests do. For each batching delay the script prints embeddings per
+second, the p50/p99 latency of one call and the average batch size.
+
+    python tests/benchmark_embedding_batcher.py --concurrency 16 --delays_ms 0 2 5 10
+"""
+
+import sys
+import time
+import argparse
+import threading
+from pathlib import Path
+
+import numpy as np
+
+# Ensure the project root is on sys.path so `src` imports work
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.embedding_batcher import EmbeddingBatcher
+from src.context_augmentation.context import encode_batch, hf_model
+from mongodb.routing_examples import COLLECTION_ROUTING_EXAMPLES
+
+
+def run_load(batcher, concurrency, seconds):
+    examples = [e for examples in COLLECTION_ROUTING_EXAMPLES.values() for e in examples]
+    latencies = [[] for _ in range(concurrency)]
+    stop_at = time.perf_counter() + seconds
+
+    def worker(i):
+        n = 0
+        while time.perf_counter() < stop_at:
+            # Distinct texts, so nothing is deduplicated within a batch
+            text = f"{examples[n % len(examples)]} ({i}-{n})"
+            start_time = time.perf_counter()
+            batcher.encode(text)
+            latencies[i].append(time.perf_counter() - start_time)
+            n += 1
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    start_time = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start_time
+
+    all_latencies = np.concatenate([np.array(l) for l in latencies if l])
+    return {
+        "per_second": len(all_latencies) / elapsed,
+        "p50_ms": float(np.percentile(all_latencies, 50) * 1000),
+        "p99_ms": float(np.percentile(all_latencies, 99) * 1000),
+    }
+
+
+def run_benchmark(concurrency, delays_ms, max_batch_size, seconds):
+    hf_model.get()
+    encode_batch(["warm up"])
+
+    print(f"{concurrency} concurrent callers, max batch {max_batch_size}")
+    print(f"  {'delay':>8} {'emb/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'avg batch':>10}")
+    for delay_ms in delays_ms:
+        batcher = EmbeddingBatcher(encode_batch, max_batch_size, delay_ms / 1000)
+        result = run_load(batcher, concurrency, seconds)
+        avg_batch = batcher.stats()["avg_batch_size"] or 1.0
+        label = "off" if delay_ms <= 0 else f"{delay_ms:g} ms"
+        print(
+            f"  {label:>8} {result['per_second']:10.1f} {result['p50_ms']:10.1f} "
+            f"{result['p99_ms']:10.1f} {avg_batch:10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--delays_ms", type=float, nargs="+", default=[0, 2, 5, 10])
+    parser.add_argument("--max_batch_size", type=int, default=64)
+    parser.add_argument("--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    run_benchmark(args.concurrency, args.delays_ms, args.max_batch_size, args.seconds)
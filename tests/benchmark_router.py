@@ -0,0 +1,116 @@
+"""
+Offline comparison of the centroid router and the k-NN exemplar router (ROUTER_MODE in
+src/context_augmentation/routing.py) on the labeled examples in mongodb/routing_examples.py
+(the routing examples and the test queries of mongodb/test_routing.py).
+
+- held-out accuracy: the test queries, routed with tables built from all routing examples
+- leave-one-out accuracy: each routing example, routed with tables built from the others
+- latency per query, one at a time and batched
+
+    python tests/benchmark_router.py --k 7 --temperature 0.05
+"""
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# Ensure the project root is on sys.path so `src` imports work
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.context_augmentation.context import encode_batch
+from src.context_augmentation.routing import RouteTable, KNNRouteTable
+from mongodb.routing_examples import COLLECTION_ROUTING_EXAMPLES, PURCHASES_ROUTING_EXAMPLES, TEST_QUERIES
+
+
+def build_tables(exemplars, k, temperature):
+    centroids = {route: np.mean(embeddings, axis=0) for route, embeddings in exemplars.items()}
+    centroid = RouteTable(centroids)
+    knn = KNNRouteTable(exemplars, k=k, temperature=temperature, fallback=centroid)
+    return centroid, knn
+
+
+def accuracy(table, embeddings, labels):
+    results = table.classify(embeddings)
+    correct = np.mean([r["route"] == label for r, label in zip(results, labels)])
+    abstained = np.mean([r.get("abstained", False) for r in results])
+    return float(correct), float(abstained)
+
+
+def leave_one_out(exemplars, k, temperature):
+    correct = {"centroid": 0, "knn": 0}
+    total = 0
+    for route, embeddings in exemplars.items():
+        for i in range(len(embeddings)):
+            rest = dict(exemplars)
+            rest[route] = np.delete(embeddings, i, axis=0)
+            centroid, knn = build_tables(rest, k, temperature)
+            query = embeddings[i]
+            correct["centroid"] += centroid.classify(query)[0]["route"] == route
+            correct["knn"] += knn.classify(query)[0]["route"] == route
+            total += 1
+    return {name: count / total for name, count in correct.items()}
+
+
+def latency(table, embeddings, repeats=20):
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        for embedding in embeddings:
+            table.classify(embedding)
+    single = (time.perf_counter() - start_time) / (repeats * len(embeddings))
+
+    start_time = time.perf_counter()
+    for _ in range(repeats):
+        table.classify(embeddings)
+    batched = (time.perf_counter() - start_time) / (repeats * len(embeddings))
+    return single, batched
+
+
+def run_benchmark(k, temperature):
+    tables = {
+        "collection": COLLECTION_ROUTING_EXAMPLES,
+        "purchases": PURCHASES_ROUTING_EXAMPLES,
+    }
+
+    for name, routing_data in tables.items():
+        exemplars = {route: encode_batch(examples) for route, examples in routing_data.items()}
+        centroid, knn = build_tables(exemplars, k, temperature)
+
+        print(f"\n{name} routing ({sum(len(e) for e in exemplars.values())} examples, "
+              f"learned abstain threshold {knn.abstain_threshold:.3f})")
+
+        loo = leave_one_out(exemplars, k, temperature)
+        print(f"  leave-one-out accuracy: centroid {loo['centroid']:.1%}, knn {loo['knn']:.1%}")
+
+        if name == "collection":
+            queries = [q for queries in TEST_QUERIES.values() for q in queries]
+            labels = [route for route, queries in TEST_QUERIES.items() for _ in queries]
+            embeddings = encode_batch(queries)
+
+            centroid_acc, _ = accuracy(centroid, embeddings, labels)
+            knn_acc, abstained = accuracy(knn, embeddings, labels)
+            print(f"  held-out accuracy ({len(queries)} test queries): centroid {centroid_acc:.1%}, "
+                  f"knn {knn_acc:.1%} (abstained on {abstained:.0%})")
+
+            for query, label, c, n in zip(queries, labels, centroid.classify(embeddings), knn.classify(embeddings)):
+                if c["route"] != label or n["route"] != label:
+                    print(f"    {query!r} ({label}): centroid -> {c['route']}, knn -> {n['route']}")
+        else:
+            embeddings = np.concatenate(list(exemplars.values()))
+
+        for table_name, table in (("centroid", centroid), ("knn", knn)):
+            single, batched = latency(table, embeddings)
+            print(f"  {table_name:<8} latency: {single * 1e6:7.1f} us/query single, {batched * 1e6:7.1f} us/query batched")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--k", type=int, default=7)
+    parser.add_argument("--temperature", type=float, default=0.05)
+    args = parser.parse_args()
+
+    run_benchmark(args.k, args.temperature)
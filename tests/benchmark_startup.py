@@ -0,0 +1,84 @@
+"""
+Startup-time benchmark.
+
+Reports, in fresh interpreters, how long `python cli.py --help` and `import src.main` take,
+then in this process the cost of the first use of each lazily loaded resource (the first
+request after a start pays for these unless they were preloaded, see src/models/lifecycle.py)
+and of the first and a repeated embedding.
+
+    python tests/benchmark_startup.py --repeats 5
+"""
+
+import sys
+import time
+import argparse
+import statistics
+import subprocess
+from pathlib import Path
+
+# Ensure the project root is on sys.path so `src` imports work
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+COMMANDS = {
+    "python (baseline)": [sys.executable, "-c", "pass"],
+    "cli.py --help": [sys.executable, "cli.py", "--help"],
+    "import src.main": [sys.executable, "-c", "import src.main"],
+}
+
+
+def time_command(command, repeats):
+    times = []
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        result = subprocess.run(command, cwd=PROJECT_ROOT, capture_output=True, text=True)
+        times.append(time.perf_counter() - start_time)
+        if result.returncode != 0:
+            return None, result.stderr.strip().splitlines()[-1]
+    return statistics.median(times), None
+
+
+def time_call(func):
+    start_time = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        return None, f"{type(e).__name__}: {e}"
+    return time.perf_counter() - start_time, None
+
+
+def report(name, seconds, error):
+    if error:
+        print(f"  {name:<32} failed ({error})")
+    else:
+        print(f"  {name:<32} {seconds * 1000:8.1f} ms")
+
+
+def run_benchmark(repeats):
+    print(f"Fresh interpreter (median of {repeats}):")
+    for name, command in COMMANDS.items():
+        report(name, *time_command(command, repeats))
+
+    print("\nIn this process:")
+    seconds, error = time_call(lambda: __import__("src.main"))
+    report("import src.main", seconds, error)
+    if error:
+        return
+
+    from src.main import mongo_client, nlp
+    from src.context_augmentation.context import hf_model, embed_text
+
+    for resource in (hf_model, nlp, mongo_client):
+        report(f"first use of {resource.name}", *time_call(resource.get))
+
+    report("first embed_text", *time_call(lambda: embed_text("Where is my latest order?")))
+    report("repeated embed_text", *time_call(lambda: embed_text("where is my latest order?")))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    run_benchmark(args.repeats)
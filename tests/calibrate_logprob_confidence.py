@@ -0,0 +1,147 @@
+"""
+Offline calibration for the token-logprob confidence mode (`--logprob_confidence`).
+
+For every prompt in data/rag_sft.jsonl this script:
+- generates the primary answer with per-token logprobs (same options as `stream_response`),
+- computes the existing ROUGE confidence score with the usual resampling.
+
+It then fits a linear map from the logprob stats (mean logprob, min logprob, entropy) to the
+ROUGE score, so the calibrated logprob score can be compared against the same `rouge_threshold`,
+and writes the coefficients to data/logprob_calibration.json (read by src/confidence_rouge.py).
+
+Requires a running Ollama with the model pulled.
+"""
+
+import json
+import argparse
+from pathlib import Path
+import sys
+
+import numpy as np
+
+# Ensure the project root is on sys.path so `src` imports work
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+if str(PROJECT_ROOT) not in sys.path:
+    sys.path.insert(0, str(PROJECT_ROOT))
+
+from src.models.slm import MODEL, OLLAMA_API, NUM_CONFIDENCE_SAMPLES, TOP_LOGPROBS, SYSTEM_PROMPT, build_messages
+from src.models.ollama_client import ollama_client, OLLAMA_KEEP_ALIVE
+from src.confidence_rouge import (
+    generate_multiple_responses,
+    calculate_rouge_confidence,
+    summarize_logprobs,
+    logprob_confidence_score,
+)
+
+FEATURES = ["mean_logprob", "min_logprob", "entropy"]
+
+
+def load_prompts(path: str, limit: int | None = None):
+    """Load the user prompts from an SFT jsonl file as chat messages, the way `stream_response` sends them."""
+    prompts = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            example = json.loads(line)
+            user_msg = next(m for m in example["messages"] if m["role"] == "user")
+            content = user_msg["content"]
+            # Logged prompts start with the system prompt, which is now sent as its own message
+            if content.startswith(SYSTEM_PROMPT):
+                content = content[len(SYSTEM_PROMPT):]
+            prompts.append(build_messages([{"role": "user", "content": content}]))
+            if limit is not None and len(prompts) >= limit:
+                break
+    return prompts
+
+
+def generate_with_logprobs(messages: list[dict]):
+    payload = {
+        "model": MODEL,
+        "messages": messages,
+        "stream": False,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "logprobs": True,
+        "top_logprobs": TOP_LOGPROBS,
+        "options": {
+            "num_predict": 100,
+            "stop": ["\n\n"],
+            "top_k": 1
+        }
+    }
+    data = ollama_client.post(OLLAMA_API, payload).json()
+    return data.get("message", {}).get("content", ""), data.get("logprobs") or []
+
+
+def fit_calibration(stats: list[dict], targets: list[float]):
+    """Least-squares fit of target ~ intercept + sum(weight * feature)."""
+    X = np.array([[1.0] + [s[f] for f in FEATURES] for s in stats])
+    y = np.array(targets)
+    coef, *_ = np.linalg.lstsq(X, y, rcond=None)
+
+    predictions = X @ coef
+    ss_res = float(np.sum((y - predictions) ** 2))
+    ss_tot = float(np.sum((y - y.mean()) ** 2))
+    r2 = 1 - ss_res / ss_tot if ss_tot > 0 else 0.0
+
+    return {
+        "intercept": float(coef[0]),
+        "weights": {f: float(w) for f, w in zip(FEATURES, coef[1:])},
+        "r2": r2,
+    }
+
+
+def run_calibration(sft_path: str, output_path: str, limit: int | None, threshold: float):
+    prompts = load_prompts(sft_path, limit)
+    print(f"Loaded {len(prompts)} prompts from {sft_path}")
+
+    stats, targets = [], []
+
+    for idx, messages in enumerate(prompts, start=1):
+        print(f"Calibrating on prompt {idx}/{len(prompts)}")
+
+        response, token_logprobs = generate_with_logprobs(messages)
+        summary = summarize_logprobs(token_logprobs)
+        if summary is None:
+            print("  No logprobs returned, this Ollama version does not support them. Skipping.")
+            continue
+
+        samples = generate_multiple_responses(MODEL, messages, NUM_CONFIDENCE_SAMPLES)
+        if not samples:
+            print("  Could not generate samples. Skipping.")
+            continue
+
+        stats.append(summary)
+        targets.append(float(calculate_rouge_confidence([response.strip()] + samples)))
+
+    if len(stats) <= len(FEATURES):
+        print(f"Only {len(stats)} usable examples, not enough to calibrate.")
+        return
+
+    calibration = fit_calibration(stats, targets)
+    calibration["num_examples"] = len(stats)
+    calibration["threshold"] = threshold
+
+    # How often the calibrated logprob decision matches the ROUGE decision at the threshold
+    agreement = np.mean([
+        (logprob_confidence_score(s, calibration) >= threshold) == (t >= threshold)
+        for s, t in zip(stats, targets)
+    ])
+    calibration["decision_agreement"] = float(agreement)
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(calibration, f, indent=2)
+
+    print(f"R^2: {calibration['r2']:.3f}, decision agreement with ROUGE: {agreement:.1%}")
+    print(f"Saved calibration to {output_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sft_path", default=str(PROJECT_ROOT / "data" / "rag_sft.jsonl"))
+    parser.add_argument("--output_path", default=str(PROJECT_ROOT / "data" / "logprob_calibration.json"))
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--threshold", type=float, default=0.25)
+    args = parser.parse_args()
+
+    run_calibration(args.sft_path, args.output_path, args.limit, args.threshold)
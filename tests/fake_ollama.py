@@ -0,0 +1,136 @@
+"""
+Fake Ollama servers for trying out the backend pool (src/models/ollama_client.py) without
+real models.
+
+    python tests/fake_ollama.py --ports 11501 11502 11503
+    OLLAMA_HOSTS=http://localhost:11501,http://localhost:11502,http://localhost:11503 python cli.py
+
+Each server answers /api/tags, /api/ps and /api/chat (streamed or not) with a canned answer
+that names its port, after `--delay` seconds per token. Only the `--models` are known (others
+get a 404), and a model drops out of /api/ps after `--evict_after` idle seconds, like Ollama's
+keep_alive. `--fail_rate` makes a share of the chat calls fail with a 500, to see hosts being
+ejected. Stop a server (or all of them with Ctrl+C) to see the health checks take it out of
+rotation.
+"""
+
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = "Your order has shipped and should arrive within 3 days."
+
+
+def make_handler(port, delay, fail_rate, models, evict_after):
+    words = [w + " " for w in f"[{port}] {ANSWER}".split()]
+    last_used = {}  # model -> time of its last call, i.e. the models "in memory"
+
+    def loaded_models():
+        now = time.time()
+        return [m for m, t in list(last_used.items()) if now - t < evict_after]
+
+    class FakeOllamaHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, body, status=200):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == "/api/tags":
+                self._send_json({"models": [{"name": m, "model": m} for m in models]})
+            elif self.path == "/api/ps":
+                self._send_json({"models": [{"name": m, "model": m} for m in loaded_models()]})
+            else:
+                self._send_json({"error": "not found"}, status=404)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+
+            if self.path != "/api/chat":
+                self._send_json({"error": "not found"}, status=404)
+                return
+
+            if request.get("model") not in models:
+                self._send_json({"error": f"model '{request.get('model')}' not found"}, status=404)
+                return
+            last_used[request["model"]] = time.time()
+
+            if random.random() < fail_rate:
+                self._send_json({"error": "fake failure"}, status=500)
+                return
+
+            done = {
+                "message": {"role": "assistant", "content": ""},
+                "done": True,
+                "prompt_eval_count": 20,
+                "prompt_eval_duration": 1_000_000,
+            }
+
+            if not request.get("stream", True):
+                time.sleep(delay * len(words))
+                done["message"]["content"] = "".join(words).strip()
+                self._send_json(done)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/x-ndjson")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+
+            def write_chunk(body):
+                data = (json.dumps(body) + "\n").encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+                self.wfile.flush()
+
+            try:
+                for word in words:
+                    time.sleep(delay)
+                    write_chunk({
+                        "message": {"role": "assistant", "content": word},
+                        "logprobs": [{"token": word, "logprob": -0.1, "top_logprobs": []}],
+                        "done": False,
+                    })
+                write_chunk(done)
+                self.wfile.write(b"0\r\n\r\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # client closed the stream early
+
+    return FakeOllamaHandler
+
+
+def serve(ports, delay, fail_rate, models, evict_after):
+    servers = []
+    for port in ports:
+        server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(port, delay, fail_rate, models, evict_after))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        print(f"Fake Ollama listening on http://127.0.0.1:{port}")
+    return servers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ports", type=int, nargs="+", default=[11501, 11502])
+    parser.add_argument("--delay", type=float, default=0.02, help="seconds per streamed token")
+    parser.add_argument("--fail_rate", type=float, default=0.0, help="share of chat calls answered with a 500")
+    parser.add_argument("--models", nargs="+", default=["phi3:3.8b"])
+    parser.add_argument("--evict_after", type=float, default=300, help="idle seconds before a model is unloaded")
+    args = parser.parse_args()
+
+    serve(args.ports, args.delay, args.fail_rate, args.models, args.evict_after)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass